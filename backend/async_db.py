@@ -0,0 +1,125 @@
+import asyncio
+import re
+from copy import copy
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine.url import make_url
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+# :1 placeholders of the 'numeric' paramstyle, but not :: casts
+NUMERIC_PLACEHOLDER = re.compile(r'(?<![:\w]):(\d+)')
+
+"""
+AsyncDatabase(url, pool_size=10, statement_timeout=None)
+    runs the SQLAlchemy Core statements of models.py on asyncpg for
+    postgresql and aiosqlite for sqlite. SQLAlchemy 1.3 has no asyncio
+    support, so statements are compiled for the dialect here and their
+    SQL and positional parameters handed to the async driver; the pool
+    connects on first use.
+"""
+class AsyncDatabase(object):
+
+    def __init__(self, url, pool_size=10, statement_timeout=None):
+        self.url = make_url(url)
+        self.backend = self.url.get_backend_name()
+        if self.backend == 'postgresql':
+            if asyncpg is None:
+                raise RuntimeError('the async mode needs asyncpg for postgresql')
+            self.dialect = postgresql.dialect(paramstyle='numeric')
+        elif self.backend == 'sqlite':
+            if aiosqlite is None:
+                raise RuntimeError('the async mode needs aiosqlite for sqlite')
+            self.dialect = sqlite.dialect()
+        else:
+            raise ValueError('no async driver for {}'.format(self.backend))
+        # every connection to an in-memory sqlite database is a new database
+        self.pool_size = pool_size if self.url.database not in (None, '', ':memory:') else 1
+        self.statement_timeout = statement_timeout
+        self._pool = None
+        self._connecting = None
+        self._compiled = {}
+
+    async def connect(self):
+        if self.backend == 'postgresql':
+            url = copy(self.url)
+            url.drivername = 'postgresql'
+            settings = {'statement_timeout': str(self.statement_timeout)} if self.statement_timeout else None
+            self._pool = await asyncpg.create_pool(str(url), min_size=1, max_size=self.pool_size,
+                                                   server_settings=settings)
+        else:
+            pool = asyncio.Queue()
+            for _ in range(self.pool_size):
+                pool.put_nowait(await aiosqlite.connect(self.url.database or ':memory:'))
+            self._pool = pool
+
+    async def close(self):
+        pool, self._pool = self._pool, None
+        self._connecting = None
+        if pool is None:
+            return
+        if self.backend == 'postgresql':
+            await pool.close()
+        else:
+            while not pool.empty():
+                await pool.get_nowait().close()
+
+    def _compile(self, statement, parameters, cache):
+        entry = self._compiled.get(statement) if cache else None
+        if entry is None:
+            compiled = statement.compile(dialect=self.dialect)
+            sql = compiled.string
+            if self.backend == 'postgresql':
+                sql = NUMERIC_PLACEHOLDER.sub(r'$\1', sql)
+            entry = (compiled, sql)
+            if cache:
+                self._compiled[statement] = entry
+        compiled, sql = entry
+        values = compiled.construct_params(parameters)
+        arguments = []
+        for name in compiled.positiontup:
+            if compiled.binds[name].expanding:
+                # SQLAlchemy expands IN lists when it executes a statement;
+                # here they must be integers, rendered inline
+                ids = [str(int(value)) for value in values[name]]
+                if not ids:
+                    raise ValueError('empty list for the expanding parameter {}'.format(name))
+                sql = sql.replace('[EXPANDING_{}]'.format(name), ', '.join(ids))
+            else:
+                arguments.append(values[name])
+        return sql, arguments
+
+    # returns the rows of statement as tuples; cache compiles statements
+    # built once and run with different parameters only once
+    async def fetch(self, statement, parameters=None, cache=False):
+        if self._pool is None:
+            if self._connecting is None:
+                self._connecting = asyncio.ensure_future(self.connect())
+            connecting = self._connecting
+            try:
+                await asyncio.shield(connecting)
+            except Exception:
+                # let the next request try again
+                if self._connecting is connecting:
+                    self._connecting = None
+                raise
+
+        sql, arguments = self._compile(statement, parameters, cache)
+        if self.backend == 'postgresql':
+            async with self._pool.acquire() as connection:
+                return [tuple(row) for row in await connection.fetch(sql, *arguments)]
+
+        connection = await self._pool.get()
+        try:
+            async with connection.execute(sql, arguments) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+        finally:
+            self._pool.put_nowait(connection)
@@ -0,0 +1,70 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.load import percentile, seed, vocabulary
+
+"""
+Autocomplete benchmark
+
+Seeds a synthetic question bank as benchmarks/load.py does, builds the
+AutocompleteIndex of flaskr/autocomplete.py over it and reports the build
+time, the memory the index holds and the latency of suggestions for
+prefixes of 1 to 3 letters, whole words and several words. From the
+backend folder run
+
+    python -m benchmarks.autocomplete --questions 100000
+"""
+
+
+def queries(words, generator):
+    word = lambda: generator.choice(words)
+    return [
+        ('1 letter', lambda: word()[:1]),
+        ('3 letters', lambda: word()[:3]),
+        ('word', lambda: word() + ' '),
+        ('2 words + prefix', lambda: '{} {} {}'.format(word(), word(), word()[:2])),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trivia autocomplete benchmark')
+    parser.add_argument('--database-url', default='sqlite:///' + os.path.join(tempfile.gettempdir(), 'trivia_bench.db'))
+    parser.add_argument('--questions', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--reseed', action='store_true')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    from flaskr import create_app
+    from flaskr.autocomplete import AutocompleteIndex
+
+    app = create_app()
+    seed(app, args.questions, args.reseed)
+
+    with app.app_context():
+        index = AutocompleteIndex(refresh=3600)
+        start = time.perf_counter()
+        index.build()
+        print('built in {:.2f} s'.format(time.perf_counter() - start))
+        stats = index.stats()
+        print('{questions} questions, {tokens} words, {postings} postings, {:.1f} MiB'.format(
+            stats['memory_bytes'] / 1024.0 / 1024.0, **stats))
+
+        generator = random.Random(2)
+        print('{:<20} {:>9} {:>9} {:>9}'.format('query', 'p50 us', 'p99 us', 'max us'))
+        for name, make_query in queries(vocabulary(), generator):
+            latencies = []
+            for _ in range(args.requests):
+                text = make_query()
+                start = time.perf_counter()
+                index.suggest(text)
+                latencies.append((time.perf_counter() - start) * 1e6)
+            print('{:<20} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                name, percentile(latencies, 0.50), percentile(latencies, 0.99), max(latencies)))
+
+
+if __name__ == '__main__':
+    main()
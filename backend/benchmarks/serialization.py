@@ -0,0 +1,81 @@
+import gzip
+import json
+import random
+import string
+import timeit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Serialization benchmark
+
+Compares the JSON encoders and the compressions of flaskr/responses.py
+on synthetic /questions pages: encoding time per page and bytes on the
+wire. From the backend folder run
+
+    python benchmarks/serialization.py
+"""
+CATEGORIES = {'1': 'Science', '2': 'Art', '3': 'Geography',
+              '4': 'History', '5': 'Entertainment', '6': 'Sports'}
+
+
+def words(count):
+    return ' '.join(''.join(random.choice(string.ascii_lowercase)
+                            for _ in range(random.randint(2, 9)))
+                    for _ in range(count))
+
+
+def questions_page(size):
+    return {
+        'questions': [{
+            'id': question_id,
+            'question': words(random.randint(6, 20)) + '?',
+            'answer': words(random.randint(1, 30)),
+            'category': random.randint(1, 6),
+            'difficulty': random.randint(1, 5)
+        } for question_id in range(size)],
+        'total_questions': 100000,
+        'categories': CATEGORIES,
+        'current_category': None
+    }
+
+
+def encoders():
+    yield 'json', lambda payload: json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    if orjson is not None:
+        yield 'orjson', lambda payload: orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+
+
+def compressions():
+    yield 'identity', lambda body: body
+    yield 'gzip', lambda body: gzip.compress(body, compresslevel=6)
+    if brotli is not None:
+        yield 'br', lambda body: brotli.compress(body, quality=6)
+
+
+def main(sizes=(10, 100, 1000), number=200):
+    print('{:>6} {:<10} {:>12}'.format('page', 'encoder', 'us/page'))
+    for size in sizes:
+        payload = questions_page(size)
+        for name, encode in encoders():
+            seconds = timeit.timeit(lambda: encode(payload), number=number) / number
+            print('{:>6} {:<10} {:>12.1f}'.format(size, name, seconds * 1e6))
+
+    print('\n{:>6} {:<10} {:>12} {:>12}'.format('page', 'encoding', 'bytes', 'us/page'))
+    for size in sizes:
+        body = next(encoders())[1](questions_page(size))
+        for name, compress in compressions():
+            seconds = timeit.timeit(lambda: compress(body), number=number) / number
+            print('{:>6} {:<10} {:>12} {:>12.1f}'.format(size, name, len(compress(body)), seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import csv
+import io
+import json
+
+from sqlalchemy import and_, func, or_, select
+
+from models import (db, bump_data_version, log_question_changes, mark_written, select_questions, Question, QuestionChange,
+                    QuestionRow, QUESTION_COLUMNS)
+from search import resume_search_index, suspend_search_index
+
+# rows per executemany or COPY statement of an import
+IMPORT_CHUNK = 5000
+# rows per SELECT of an export, ids per IN list of a batch delete
+EXPORT_CHUNK = 1000
+FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+"""
+InvalidRow(line, reason)
+    raised while reading an import, with the 1-based line of the bad row
+"""
+class InvalidRow(ValueError):
+
+    def __init__(self, line, reason):
+        super(InvalidRow, self).__init__('line {}: {}'.format(line, reason))
+        self.line = line
+        self.reason = reason
+
+"""
+read_rows(lines, format)
+    yields the questions of an NDJSON or CSV stream of text lines as
+    dicts ready to insert, raising InvalidRow at the first bad one; id is
+    optional, category and difficulty may be empty
+"""
+def read_rows(lines, format):
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield clean_row(reader.line_num, row)
+    else:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise InvalidRow(number, 'invalid JSON')
+            yield clean_row(number, row)
+
+
+def _integer(value):
+    return None if value is None or value == '' else int(value)
+
+"""
+clean_row(number, row)
+    validates one question object and returns its values to insert, or
+    raises InvalidRow for the given line or item number
+"""
+def clean_row(number, row):
+    if not isinstance(row, dict):
+        raise InvalidRow(number, 'expected an object')
+    if not row.get('question') or not row.get('answer'):
+        raise InvalidRow(number, 'question and answer are required')
+    try:
+        values = {
+            'question': str(row['question']),
+            'answer': str(row['answer']),
+            'category': _integer(row.get('category')),
+            'difficulty': _integer(row.get('difficulty'))
+        }
+        if _integer(row.get('id')) is not None:
+            values['id'] = int(row['id'])
+    except (TypeError, ValueError):
+        raise InvalidRow(number, 'id, category and difficulty must be integers')
+    return values
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _executemany(connection, rows, columns):
+    connection.execute(Question.__table__.insert(), rows)
+
+
+def _copy(connection, rows, columns):
+    # in COPY's csv format an unquoted empty field is NULL
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert('COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(', '.join(columns)), buffer)
+
+"""
+import_questions(rows, connection)
+    inserts rows, as yielded by read_rows, IMPORT_CHUNK at a time: with
+    COPY on postgresql through psycopg2 and executemany INSERTs otherwise,
+    rebuilding the sqlite search index once at the end of large imports.
+    Everything runs in the connection's transaction, which the caller
+    commits or rolls back; returns how many questions were inserted
+"""
+def import_questions(rows, connection):
+    postgresql = connection.dialect.name == 'postgresql'
+    load = _copy if postgresql and connection.dialect.driver == 'psycopg2' else _executemany
+    count = 0
+    explicit_ids = False
+    # ids below the current largest one, the others are logged at the end
+    last_id = connection.execute(select([func.max(Question.id)])).scalar() or 0
+    logged = []
+    suspended = False
+    for index, chunk in enumerate(_chunks(rows, IMPORT_CHUNK)):
+        if index == 1:
+            # past one chunk, indexing the table once for search beats
+            # indexing every row as it is inserted
+            suspended = suspend_search_index(connection)
+        with_id = [row for row in chunk if 'id' in row]
+        without_id = [row for row in chunk if 'id' not in row]
+        if with_id:
+            load(connection, with_id, FIELDS)
+            explicit_ids = True
+            logged.extend(row['id'] for row in with_id if row['id'] <= last_id)
+        if without_id:
+            load(connection, without_id, FIELDS[1:])
+        count += len(chunk)
+
+    if suspended:
+        resume_search_index(connection)
+    if postgresql and explicit_ids:
+        # move the id sequence past the ids that were given
+        connection.execute("SELECT setval(pg_get_serial_sequence('questions', 'id'), "
+                           "(SELECT MAX(id) FROM questions))")
+    if count:
+        version = bump_data_version(connection, 'questions')
+        log_question_changes(connection, version, logged, after_id=last_id)
+        mark_written()
+    return count
+
+"""
+insert_questions(rows, connection)
+    inserts a batch of rows from clean_row in the connection's transaction,
+    bumping the questions version once, and returns their ids, in order:
+    on postgresql the ids are drawn from the sequence in one query and the
+    rows inserted with one executemany, elsewhere each row is inserted in
+    turn
+"""
+def insert_questions(rows, connection):
+    table = Question.__table__
+    if not rows:
+        return []
+    if connection.dialect.name != 'postgresql':
+        ids = [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+    else:
+        sequence = func.pg_get_serial_sequence('questions', 'id')
+        ids = [id for id, in connection.execute(
+            select([func.nextval(sequence)]).select_from(func.generate_series(1, len(rows))))]
+        connection.execute(table.insert(), [dict(row, id=id) for row, id in zip(rows, ids)])
+    log_question_changes(connection, bump_data_version(connection, 'questions'), ids)
+    mark_written()
+    return ids
+
+"""
+delete_questions(ids, connection)
+    deletes the questions of ids in the connection's transaction, with one
+    DELETE per EXPORT_CHUNK ids, bumping the questions version once if any
+    existed, and returns the deleted rows formatted
+"""
+def delete_questions(ids, connection):
+    deleted = []
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), EXPORT_CHUNK):
+        chunk = ids[start:start + EXPORT_CHUNK]
+        deleted.extend(row.format() for row in select_questions([Question.id.in_(chunk)]))
+        connection.execute(Question.__table__.delete().where(Question.id.in_(chunk)))
+    if deleted:
+        version = bump_data_version(connection, 'questions')
+        log_question_changes(connection, version, [question['id'] for question in deleted], deleted=True)
+        mark_written()
+    return deleted
+
+"""
+export_questions(format, criteria=())
+    yields the matching questions as NDJSON or CSV text, one chunk of
+    EXPORT_CHUNK rows at a time read by id, so the table is never held
+    in memory
+"""
+def export_questions(format, criteria=()):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == 'csv':
+        writer.writerow(FIELDS)
+
+    last_id = None
+    while True:
+        page = list(criteria) if last_id is None else list(criteria) + [Question.id > last_id]
+        rows = select_questions(page, limit=EXPORT_CHUNK)
+        for row in rows:
+            if format == 'csv':
+                writer.writerow([getattr(row, field) for field in FIELDS])
+            else:
+                buffer.write(json.dumps(row.format(), sort_keys=True, separators=(',', ':')))
+                buffer.write('\n')
+        if buffer.tell():
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if len(rows) < EXPORT_CHUNK:
+            return
+        last_id = rows[-1].id
+
+
+def _ndjson(payload):
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')) + '\n'
+
+"""
+export_changes(since, version)
+    yields as NDJSON the question changes after version since, in version
+    order and EXPORT_CHUNK log rows at a time: {"version", "id",
+    "question"} for a question written, {"version", "id", "deleted": true}
+    for a tombstone. With since None it yields every question instead, at
+    version, the current one, for clients starting from scratch
+"""
+def export_changes(since, version):
+    if since is None:
+        last_id = None
+        while True:
+            criteria = [] if last_id is None else [Question.id > last_id]
+            rows = select_questions(criteria, limit=EXPORT_CHUNK)
+            if rows:
+                yield ''.join(_ndjson({'version': version, 'id': row.id, 'question': row.format()}) for row in rows)
+            if len(rows) < EXPORT_CHUNK:
+                return
+            last_id = rows[-1].id
+
+    changes = QuestionChange.__table__
+    statement = select([changes.c.version, changes.c.question_id, changes.c.deleted] + QUESTION_COLUMNS) \
+        .select_from(changes.outerjoin(Question.__table__, Question.id == changes.c.question_id)) \
+        .order_by(changes.c.version, changes.c.question_id).limit(EXPORT_CHUNK)
+    after = changes.c.version > since
+    while True:
+        rows = db.session.execute(statement.where(after)).fetchall()
+        lines = []
+        for row in rows:
+            if row[2]:
+                lines.append(_ndjson({'version': row[0], 'id': row[1], 'deleted': True}))
+            elif row[3] is not None:
+                lines.append(_ndjson({'version': row[0], 'id': row[1], 'question': QuestionRow(*row[3:]).format()}))
+            # else deleted since: its tombstone comes later
+        if lines:
+            yield ''.join(lines)
+        if len(rows) < EXPORT_CHUNK:
+            return
+        last_version, last_id = rows[-1][0], rows[-1][1]
+        after = or_(changes.c.version > last_version,
+                    and_(changes.c.version == last_version, changes.c.question_id > last_id))
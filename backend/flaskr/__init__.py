@@ -1,17 +1,183 @@
 import os
-from flask import Flask, request, abort, jsonify
+from datetime import datetime, timedelta
+
+import click
+from flask import Flask, g, request, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy.exc import SQLAlchemyError
 
-from models import setup_db, Question, Category
+from models import (db, setup_db, pool_stats, category_registry, compact_question_changes, data_versions,
+                    get_question_row, notify_question_listeners, primary_written, question_ids, random_question,
+                    random_questions, register_question_listener, select_questions, use_replica, Question)
+from search import setup_search, search_questions, count_search_results
+from bulk import (FORMATS, InvalidRow, clean_row, delete_questions, export_changes, export_questions,
+                  import_questions, insert_questions, read_rows)
+from .autocomplete import AutocompleteIndex
+from .buckets import QuestionBuckets
+from .cache import LRUCache, ResponseCache
+from .instrumentation import Instrumentation
+from .responses import (choose_encoding, compress, compress_response, conditional, dumps, encode, encoded_response,
+                        jsonify)
+from .quiz_sessions import make_session_store
+from .stats import QuestionStats
 
 QUESTIONS_PER_PAGE = 10
+# set on clients that just wrote, whose reads then stay on the primary
+READ_PRIMARY_COOKIE = 'read_primary'
+
+"""
+paginate_questions(request, criteria=())
+    selects one page of the questions matching criteria in the database,
+    either by ?page=N (LIMIT/OFFSET) or by the ?after_id=ID keyset cursor,
+    and returns them formatted
+"""
+def paginate_questions(request, criteria=()):
+    criteria = list(criteria)
+    offset = 0
+    after_id = request.args.get('after_id', None, type=int)
+    if after_id is not None:
+        criteria.append(Question.id > after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        offset = max(page - 1, 0) * QUESTIONS_PER_PAGE
+
+    questions = select_questions(criteria, offset=offset, limit=QUESTIONS_PER_PAGE)
+    return [question.format() for question in questions]
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        QUIZ_SESSION_STORE=os.environ.get('QUIZ_SESSION_STORE', 'memory'),
+        QUIZ_SESSION_TTL=int(os.environ.get('QUIZ_SESSION_TTL', 3600)),
+        QUIZ_SESSION_MAXSIZE=int(os.environ.get('QUIZ_SESSION_MAXSIZE', 10000)),
+        QUIZ_SESSION_MAX_QUESTIONS=int(os.environ.get('QUIZ_SESSION_MAX_QUESTIONS', 1000)),
+        SEARCH_CACHE_SIZE=int(os.environ.get('SEARCH_CACHE_SIZE', 1024)),
+        SEARCH_MAX_AGE=int(os.environ.get('SEARCH_MAX_AGE', 60)),
+        JSON_SERIALIZER=os.environ.get('JSON_SERIALIZER', 'orjson'),
+        COMPRESS_ENABLED=os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true',
+        COMPRESS_MIN_SIZE=int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),
+        COMPRESS_LEVEL=int(os.environ.get('COMPRESS_LEVEL', 6)),
+        EXPOSE_POOL_STATS=os.environ.get('EXPOSE_POOL_STATS', 'false').lower() == 'true',
+        INSTRUMENTATION=os.environ.get('INSTRUMENTATION', 'false').lower() == 'true',
+        PROFILE_SLOW_REQUESTS_MS=int(os.environ.get('PROFILE_SLOW_REQUESTS_MS', 0)),
+        PROFILE_INTERVAL_MS=int(os.environ.get('PROFILE_INTERVAL_MS', 5)),
+        BATCH_MAX_SIZE=int(os.environ.get('BATCH_MAX_SIZE', 10000)),
+        QUIZ_PREFETCH_MAX=int(os.environ.get('QUIZ_PREFETCH_MAX', 20)),
+        REPLICA_STICKY_SECONDS=int(os.environ.get('REPLICA_STICKY_SECONDS', 5)),
+        AUTOCOMPLETE_MAX=int(os.environ.get('AUTOCOMPLETE_MAX', 10)),
+        AUTOCOMPLETE_REFRESH=int(os.environ.get('AUTOCOMPLETE_REFRESH', 5)),
+        QUIZ_BUCKETS_REFRESH=int(os.environ.get('QUIZ_BUCKETS_REFRESH', 5)),
+        RESPONSE_CACHE_BYTES=int(os.environ.get('RESPONSE_CACHE_BYTES', 16 * 1024 * 1024)),
+        RESPONSE_CACHE_PRECOMPRESS=os.environ.get('RESPONSE_CACHE_PRECOMPRESS', 'true').lower() == 'true',
+        QUESTION_CHANGES_RETENTION_DAYS=int(os.environ.get('QUESTION_CHANGES_RETENTION_DAYS', 30)),
+        ASGI_POOL_SIZE=int(os.environ.get('ASGI_POOL_SIZE', os.environ.get('DB_POOL_SIZE', 10))),
+        ASGI_WSGI_THREADS=int(os.environ.get('ASGI_WSGI_THREADS', 8)),
+        DB_STATEMENT_TIMEOUT=int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000)),
+    )
+    if test_config is not None:
+        # e.g. SQLALCHEMY_DATABASE_URI='sqlite://' for an in-memory database
+        app.config.from_mapping(test_config)
     setup_db(app)
+    setup_search(app)
+
+    # per request SQL and timing metrics, registered first so that its
+    # after_request hook runs last and its timings include compression
+    if app.config['INSTRUMENTATION']:
+        instrumentation = Instrumentation(app)
+
+        @app.route('/metrics', methods=['GET'])
+        def get_metrics():
+            return app.response_class(instrumentation.prometheus(), mimetype='text/plain')
+
+        @app.route('/metrics/slow', methods=['GET'])
+        def get_slow_requests():
+            return jsonify({
+                'success': True,
+                'requests': list(instrumentation.slow)
+                })
+    quiz_sessions = make_session_store(app.config)
+
+    # search results by (normalized term, page); any question write clears it
+    search_cache = LRUCache(maxsize=app.config['SEARCH_CACHE_SIZE'])
+    register_question_listener(app, lambda *args: search_cache.clear())
+
+    # question counts per category and difficulty, kept up to date by writes
+    question_stats = QuestionStats()
+    register_question_listener(app, question_stats.question_listener)
+    app.extensions['question_stats'] = question_stats
+
+    # word and prefix index of the questions for search-as-you-type, built
+    # by the first autocomplete request and patched by writes
+    autocomplete = AutocompleteIndex(app.config['AUTOCOMPLETE_MAX'], app.config['AUTOCOMPLETE_REFRESH'])
+    register_question_listener(app, autocomplete.question_listener)
+    app.extensions['autocomplete'] = autocomplete
+
+    # question ids by category and difficulty for the difficulty quiz
+    # modes, built by the first draw and patched by writes
+    quiz_buckets = QuestionBuckets(app.config['QUIZ_BUCKETS_REFRESH'])
+    register_question_listener(app, quiz_buckets.question_listener)
+    app.extensions['quiz_buckets'] = quiz_buckets
+
+    # rendered pages of /questions and /categories/<id>/questions, tagged
+    # with their category, None for /questions which counts them all
+    response_cache = ResponseCache(app.config['RESPONSE_CACHE_BYTES'])
+    app.extensions['response_cache'] = response_cache
+
+    def invalidate_pages(action, questions, previous):
+        if action == 'import':
+            response_cache.clear()
+            return
+        categories = set(question['category'] for question in questions)
+        # an edit moving a question empties the pages of both categories
+        categories.update(question['category'] for question in previous or () if 'category' in question)
+        response_cache.invalidate([None] + list(categories), data_versions(['questions'])['questions'][0])
+    register_question_listener(app, invalidate_pages)
+
+    def cached_page(category_id, render):
+        # the body of render(), serialized and, with RESPONSE_CACHE_PRECOMPRESS,
+        # compressed for this client once per data version; @conditional
+        # views only, which read the versions into g.data_versions
+        if not app.config['RESPONSE_CACHE_BYTES']:
+            return jsonify(render())
+        key = (request.endpoint, category_id, request.args.get('page', 1, type=int),
+               request.args.get('after_id', None, type=int), g.data_versions['categories'][0])
+        version = g.data_versions['questions'][0]
+        body = response_cache.get_or_compute(key, lambda: dumps(render()), [category_id], version)
+        encoding = choose_encoding(len(body)) if app.config['RESPONSE_CACHE_PRECOMPRESS'] else None
+        if encoding is not None:
+            body = response_cache.get_or_compute(key + (encoding,), lambda: encode(body, encoding),
+                                                 [category_id], version)
+        return encoded_response(body, encoding)
+
+    def cached_search(term, page):
+        term = ' '.join(term.split()).lower()
+        page = max(page, 1)
+        generation = search_cache.generation
+        result = search_cache.get((term, page))
+        if result is None:
+            results = search_questions(term, (page - 1) * QUESTIONS_PER_PAGE,
+                                       QUESTIONS_PER_PAGE, app.config['SEARCH_BACKEND'])
+            formatted_question = []
+            for question, score in results:
+                formatted = question.format()
+                formatted['score'] = round(float(score), 4)
+                formatted_question.append(formatted)
+            result = (formatted_question, count_search_results(term, app.config['SEARCH_BACKEND']))
+            search_cache.set((term, page), result, generation)
+        return result
+
+    def load_questions(lines, format):
+        # one transaction for the whole file, rolled back at the first error
+        try:
+            count = import_questions(read_rows(lines, format), db.session.connection())
+            db.session.commit()
+        except (InvalidRow, SQLAlchemyError):
+            db.session.rollback()
+            raise
+        notify_question_listeners('import', None)
+        return count
 
     """
     @DONE: Set up CORS. Allow '*' for origins. Delete the sample route after completing the DONEs
@@ -27,23 +193,41 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Headers', 'GET, POST, PATCH, DELETE, OPTIONS')
         return response
 
+    # with DB_REPLICA_URLS set, GET requests and quiz draws read from a
+    # replica, except for clients that wrote in the last
+    # REPLICA_STICKY_SECONDS and would not find their writes there yet
+    def read_from_replica():
+        if READ_PRIMARY_COOKIE not in request.cookies:
+            use_replica()
+
+    @app.before_request
+    def route_reads():
+        if request.method in ('GET', 'HEAD'):
+            read_from_replica()
+
+    @app.after_request
+    def read_your_writes(response):
+        if primary_written() and 'replicas' in app.extensions:
+            response.set_cookie(READ_PRIMARY_COOKIE, '1', max_age=app.config['REPLICA_STICKY_SECONDS'])
+        return response
+
+    # serialize with orjson when available and compress large bodies,
+    # see flaskr/responses.py and its compress() decorator per endpoint
+    app.after_request(compress_response)
+
     """
     @DONE:
     Create an endpoint to handle GET requests
     for all available categories.
     """
     @app.route('/categories', methods=['GET', 'DELETE'])
+    @conditional('categories')
     def get_categories():
         if request.method == 'DELETE':
             abort(405)
 
-        categories = Category.query.all()
-        formatted_categories = {}
-        for index, category in enumerate(categories):
-            formatted_categories[str(category.id)] = category.type
-        
         return jsonify({
-            'categories':formatted_categories,
+            'categories':category_registry.all(),
             })
 
     """
@@ -54,30 +238,22 @@ def create_app(test_config=None):
     number of total questions, current category, categories.
     """
     @app.route('/questions', methods=['GET'])
+    @conditional('questions', 'categories')
     #@cross_origin
     def get_questions():
-        # Implement pagination
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-
-        questions = Question.query.all()
-        formatted_question = [question.format() for question in questions]
-        # Categories
-        categories = Category.query.all()
-        formatted_categories = {}
-        for index, category in enumerate(categories):
-            formatted_categories[str(index+1)] = category.type
-        
-        if len(formatted_question[start:end]) == 0:
-            abort(422)
-            
-        return jsonify({
-            'questions':formatted_question[start:end],
-            'total_questions':len(questions),
-            'categories':formatted_categories,
-            'current_category': None
-            })
+        def render():
+            # Implement pagination
+            formatted_question = paginate_questions(request)
+            if len(formatted_question) == 0:
+                abort(422)
+
+            return {
+                'questions':formatted_question,
+                'total_questions':question_stats.total(),
+                'categories':category_registry.all(),
+                'current_category': None
+                }
+        return cached_page(None, render)
             
     """
     TEST: At this point, when you start the application
@@ -121,22 +297,16 @@ def create_app(test_config=None):
         category = body.get('category', None)
         difficulty = body.get('difficulty', None)
 
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-        
-        questions = Question.query.all()
-
         # Search logic        
         searchTerm = body.get('searchTerm', None)
         if searchTerm is not None:
-            filter_questions = Question.query.filter(Question.question.ilike("%{}%".format(searchTerm))).all()
-            formatted_question = [question.format() for question in filter_questions]
+            page = request.args.get('page', 1, type=int)
+            formatted_question, total_questions = cached_search(searchTerm, page)
             
             return jsonify({
                 'success': True,
-                "questions": formatted_question[start:end],
-                "total_questions": len(questions),
+                "questions": formatted_question,
+                "total_questions": total_questions,
                 "current_category": None
                 })
 
@@ -145,13 +315,12 @@ def create_app(test_config=None):
                 question = Question(question=question,answer=answer,category=category,difficulty=difficulty)
                 question.insert()
                 
-                questions = Question.query.all()
-                formatted_question = [question.format() for question in questions]
+                formatted_question = paginate_questions(request)
                 return jsonify({
                     'success': True,
                     'created': question.id,
-                    'questions':formatted_question[start:end],
-                    'total_questions': len(questions),
+                    'questions':formatted_question,
+                    'total_questions': question_stats.total(),
                     'current_category': question.category
                 })
             except:
@@ -168,7 +337,223 @@ def create_app(test_config=None):
     only question that include that string within their question.
     Try using the word "title" to start.
     """
-    # I added the logic in add_question controller
+    # I added the logic in add_question controller, and GET /questions/search
+    # serves the same results so browsers and proxies can cache them
+    @app.route('/questions/search', methods=['GET'])
+    @conditional('questions')
+    def search_questions_by_term():
+        searchTerm = request.args.get('q', None)
+        if searchTerm is None:
+            abort(422)
+
+        page = request.args.get('page', 1, type=int)
+        formatted_question, total_questions = cached_search(searchTerm, page)
+
+        response = jsonify({
+            'success': True,
+            "questions": formatted_question,
+            "total_questions": total_questions,
+            "current_category": None
+            })
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['SEARCH_MAX_AGE']
+        return response
+
+    # GET /questions/autocomplete?q=what is the hea suggests the questions
+    # containing the typed words, the last one completed, from memory
+    @app.route('/questions/autocomplete', methods=['GET'])
+    def autocomplete_questions():
+        text = request.args.get('q', None)
+        limit = request.args.get('limit', app.config['AUTOCOMPLETE_MAX'], type=int)
+        if text is None or not 0 < limit <= app.config['AUTOCOMPLETE_MAX']:
+            abort(422)
+
+        response = jsonify({
+            'success': True,
+            'suggestions': autocomplete.suggest(text, limit)
+            })
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['AUTOCOMPLETE_REFRESH']
+        return response
+
+    """
+    Batch writes: POST /questions/batch creates {"questions": [...]} and
+    DELETE /questions/batch deletes {"ids": [...]}. Every item is checked
+    before anything is written, then the whole batch is applied in one
+    transaction, bumping the questions version and notifying the question
+    listeners once.
+    """
+    def batch_items(key):
+        body = request.get_json(silent=True) or {}
+        items = body.get(key, None)
+        if not isinstance(items, list) or len(items) > app.config['BATCH_MAX_SIZE']:
+            abort(422)
+        return items
+
+    def batch_errors(errors):
+        return jsonify({
+            "success": False,
+            "error": 422,
+            "message": "unprocessable",
+            "errors": errors
+            }), 422
+
+    @app.route('/questions/batch', methods=['POST'])
+    def add_questions_batch():
+        rows = []
+        errors = []
+        for index, item in enumerate(batch_items('questions')):
+            try:
+                row = clean_row(index, item)
+                if row['category'] is not None and category_registry.get(row['category']) is None:
+                    raise InvalidRow(index, 'unknown category')
+            except InvalidRow as error:
+                errors.append({'index': index, 'reason': error.reason})
+                continue
+            row.pop('id', None)
+            rows.append(row)
+        if errors:
+            return batch_errors(errors)
+
+        try:
+            ids = insert_questions(rows, db.session.connection())
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+        if ids:
+            notify_question_listeners('insert', [dict(row, id=id) for row, id in zip(rows, ids)])
+
+        return jsonify({
+            'success': True,
+            'results': [{'index': index, 'id': id} for index, id in enumerate(ids)],
+            'total_questions': question_stats.total()
+            })
+
+    @app.route('/questions/batch', methods=['DELETE'])
+    def delete_questions_batch():
+        ids = []
+        errors = []
+        for index, item in enumerate(batch_items('ids')):
+            if isinstance(item, int) and not isinstance(item, bool):
+                ids.append(item)
+            else:
+                errors.append({'index': index, 'reason': 'ids must be integers'})
+        if errors:
+            return batch_errors(errors)
+
+        try:
+            deleted = delete_questions(ids, db.session.connection())
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+        if deleted:
+            notify_question_listeners('delete', deleted)
+
+        found = set(question['id'] for question in deleted)
+        return jsonify({
+            'success': True,
+            'results': [{'id': id, 'deleted': id in found} for id in ids],
+            'total_questions': question_stats.total()
+            })
+
+    """
+    Bulk import and export of questions as NDJSON (one question object per
+    line) or CSV (id,question,answer,category,difficulty with a header).
+    POST /questions/import reads the body as CSV when its Content-Type is
+    text/csv, as NDJSON otherwise; the flask import-questions and
+    export-questions commands do the same with files.
+    """
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions_file():
+        format = 'csv' if request.mimetype == FORMATS['csv'] else 'ndjson'
+        lines = (line.decode('utf-8') for line in request.stream)
+        try:
+            count = load_questions(lines, format)
+        except InvalidRow as error:
+            return jsonify({
+                "success": False,
+                "error": 422,
+                "message": "unprocessable",
+                "line": error.line,
+                "reason": error.reason
+                }), 422
+        except SQLAlchemyError:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'imported': count,
+            'total_questions': question_stats.total()
+            })
+
+    @app.route('/questions/export', methods=['GET'])
+    def export_questions_file():
+        format = request.args.get('format', 'ndjson')
+        if format not in FORMATS:
+            abort(422)
+
+        response = app.response_class(stream_with_context(export_questions(format)),
+                                      mimetype=FORMATS[format])
+        response.headers['Content-Disposition'] = 'attachment; filename=questions.' + format
+        return response
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', type=click.Choice(sorted(FORMATS)), help='defaults to the file extension')
+    def import_questions_command(source, format):
+        """Load questions from an NDJSON or CSV file, - for stdin."""
+        format = format or ('csv' if source.name.endswith('.csv') else 'ndjson')
+        try:
+            count = load_questions(source, format)
+        except InvalidRow as error:
+            raise click.ClickException(str(error))
+        except SQLAlchemyError as error:
+            raise click.ClickException(str(getattr(error, 'orig', error)))
+        click.echo('Imported {} questions'.format(count))
+
+    @app.cli.command('export-questions')
+    @click.argument('target', type=click.File('w', encoding='utf-8'), default='-')
+    @click.option('--format', type=click.Choice(sorted(FORMATS)), help='defaults to the file extension')
+    def export_questions_command(target, format):
+        """Write every question to an NDJSON or CSV file, - for stdout."""
+        format = format or ('csv' if target.name.endswith('.csv') else 'ndjson')
+        for chunk in export_questions(format):
+            target.write(chunk)
+
+    """
+    Delta sync: GET /questions/changes?since=V streams, as NDJSON, the
+    questions written and the tombstones of those deleted after version
+    V, with the current version in X-Data-Version. Without since it
+    streams every question; a since older than the log's compaction floor
+    gets 410 and the client starts again without it. The flask
+    compact-changes command drops superseded changes and tombstones older
+    than QUESTION_CHANGES_RETENTION_DAYS.
+    """
+    @app.route('/questions/changes', methods=['GET'])
+    def get_question_changes():
+        since = request.args.get('since', None, type=int)
+        if 'since' in request.args and (since is None or since < 0):
+            abort(422)
+        versions = data_versions(['questions', 'question_changes'])
+        if since is not None and since < versions['question_changes'][0]:
+            abort(410)
+
+        version = versions['questions'][0]
+        response = app.response_class(stream_with_context(export_changes(since, version)),
+                                      mimetype='application/x-ndjson')
+        response.headers['X-Data-Version'] = str(version)
+        return response
+
+    @app.cli.command('compact-changes')
+    @click.option('--days', type=int, help='tombstones to keep, QUESTION_CHANGES_RETENTION_DAYS by default')
+    def compact_changes_command(days):
+        """Drop superseded question changes and old tombstones."""
+        days = app.config['QUESTION_CHANGES_RETENTION_DAYS'] if days is None else days
+        dropped = compact_question_changes(db.session.connection(), datetime.utcnow() - timedelta(days=days))
+        db.session.commit()
+        click.echo('Dropped {} changes'.format(dropped))
 
     """
     @DONE:
@@ -179,22 +564,52 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @conditional('questions', 'categories')
     def get_questions_by_category_id(category_id):
-        category = Category.query.filter(Category.id == category_id).one_or_none()
+        category = category_registry.get(category_id)
         if category is None:
             abort(404)
         
-        questions = Question.query.filter(Question.category == category.id).all()
-        formatted_question = [question.format() for question in questions]
+        def render():
+            criteria = [Question.category == category_id]
+            formatted_question = paginate_questions(request, criteria)
 
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
+            return {
+                "questions": formatted_question,
+                "total_questions": question_stats.total(category_id),
+                "current_category": category
+                }
+        return cached_page(category_id, render)
+
+    """
+    Question counts per category, per difficulty and per category and
+    difficulty, served from memory
+    """
+    @app.route('/stats', methods=['GET'])
+    @conditional('questions', 'categories')
+    def get_stats():
+        stats = question_stats.summary()
+        stats['success'] = True
+        return jsonify(stats)
 
+    """
+    Everything the question list shows on load, in one response:
+    categories, the first page of questions, the total and per category
+    counts and the data versions of its ETag. Categories and counts come
+    from memory, so the page is the only query besides the versions.
+    """
+    @app.route('/bootstrap', methods=['GET'])
+    @conditional('questions', 'categories')
+    def get_bootstrap():
+        stats = question_stats.summary()
         return jsonify({
-            "questions": formatted_question[start:end],
-            "total_questions": len(questions),
-            "current_category": category.type
+            'success': True,
+            'categories': category_registry.all(),
+            'questions': [question.format() for question in select_questions(limit=QUESTIONS_PER_PAGE)],
+            'total_questions': stats['total_questions'],
+            'category_counts': stats['categories'],
+            'current_category': None,
+            'data_versions': dict((name, version) for name, (version, updated_at) in g.data_versions.items())
             })
 
     """
@@ -207,39 +622,112 @@ def create_app(test_config=None):
     TEST: In the "Play" tab, after a user selects "All" or a category,
     one question at a time is displayed, the user is allowed to answer
     and shown whether they were correct or not.
+
+    Session mode: posting {"quiz_category": ..., "session": true} starts a
+    quiz over a shuffled order of the category's questions kept on the
+    server; later calls only post {"session_id": ...} to get the next one.
+
+    Prefetch mode: posting "count": N as well returns up to N distinct
+    questions at once, drawn with one query, so that the client plays N
+    questions per round trip.
+
+    Difficulty modes: posting "difficulty": D draws questions of
+    difficulty D, or of the nearest one once those are used up;
+    "difficulty": "adaptive" with "correct_answers": K starts at the
+    category's easiest difficulty and goes one up per correct answer.
+    Both draw ids from quiz_buckets in memory and work with "count".
     """
+    def next_session_question(session_id):
+        question = None
+        try:
+            while question is None:
+                question_id = quiz_sessions.pop(session_id)
+                if question_id is None:
+                    break
+                # skip questions deleted since the session started
+                question = get_question_row(question_id)
+        except KeyError:
+            abort(404)
+
+        return jsonify({
+            "question": question.format() if question else None,
+            "session_id": session_id
+            })
+
     @app.route('/quizzes', methods=['POST'])
+    @compress(enabled=False)
     def get_quizzes():
         body = request.get_json()
+        session_id = body.get('session_id', None)
+        if session_id is not None:
+            return next_session_question(session_id)
+
         previous_questions = body.get('previous_questions', [])
         quiz_category = body.get('quiz_category', None)
         if (previous_questions is None) or (quiz_category is None):
             abort(404)
-        try:   
-            if quiz_category['id'] == 0:
-                questions = Question.query.filter(Question.id.notin_(previous_questions)).all()
-                # print('b questions',questions)
+        count = body.get('count', None)
+        if count is not None and not (isinstance(count, int)
+                                      and 0 < count <= app.config['QUIZ_PREFETCH_MAX']):
+            abort(422)
+        difficulty = body.get('difficulty', None)
+        correct_answers = body.get('correct_answers', 0)
+        if difficulty is not None and not (difficulty == 'adaptive' or isinstance(difficulty, int)):
+            abort(422)
+        if not isinstance(correct_answers, int) or correct_answers < 0:
+            abort(422)
+        try:
+            category_id = int(quiz_category['id'])
+            if body.get('session', False):
+                session_id = quiz_sessions.create(question_ids(category_id or None))
+            elif difficulty is not None:
+                read_from_replica()
+                if difficulty == 'adaptive':
+                    difficulty = quiz_buckets.ramp(category_id or None, correct_answers)
+                ids = quiz_buckets.draw(count or 1, category_id or None, difficulty or 0, previous_questions)
+                rows = dict((row.id, row) for row in select_questions([Question.id.in_(ids)])) if ids else {}
+                # ids deleted since the buckets were read are skipped
+                questions = [rows[question_id] for question_id in ids if question_id in rows]
+                question = questions[0] if questions else None
+            elif count is not None:
+                read_from_replica()
+                questions = random_questions(count, category=category_id or None, exclude=previous_questions)
             else:
-                questions = Question.query.filter(Question.category == quiz_category['id']).filter(Question.id.notin_(previous_questions)).all()
-            # choose random number amont index of array  
-            if len(questions) == 0:
-                return jsonify({
-                    "question": None
-                    })
-
-            nrb_questions = 1
-            if len(questions) != 0:
-                nrb_questions = len(questions)
-            print('nrb_questions', nrb_questions)
-            print('questions', questions)
-            question = questions[random.randint(0, (nrb_questions-1) )]
-                
-            return jsonify({
-                "question": question.format()
-                })
+                read_from_replica()
+                question = random_question(category=category_id or None, exclude=previous_questions)
         except:
             abort(500)
 
+        if session_id is not None:
+            return next_session_question(session_id)
+
+        if count is not None:
+            formatted_question = [question.format() for question in questions]
+            return jsonify({
+                "question": formatted_question[0] if formatted_question else None,
+                "questions": formatted_question
+                })
+
+        if question is None:
+            return jsonify({
+                "question": None
+                })
+
+        return jsonify({
+            "question": question.format()
+            })
+
+    """
+    Connection pool introspection, only served when EXPOSE_POOL_STATS is true
+    """
+    if app.config['EXPOSE_POOL_STATS']:
+        @app.route('/debug/pool', methods=['GET'])
+        def get_pool_stats():
+            return jsonify({
+                'success': True,
+                'pool': pool_stats(db.get_engine(app))
+                })
+
     """
     @DONE:
     Create error handlers for all expected errors
@@ -253,6 +741,14 @@ def create_app(test_config=None):
         "message": "Not found"
         }), 404
         
+    @app.errorhandler(410)
+    def gone(error):
+        return jsonify({
+        "success": False, 
+        "error": 410,
+        "message": "Gone"
+        }), 410
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -0,0 +1,493 @@
+import asyncio
+import gzip
+import io
+import json
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import parse_qs
+
+from sqlalchemy import select
+
+from async_db import AsyncDatabase
+from models import (count_statement, data_versions_statement, id_range_statement, questions_statement, random_seeks,
+                    RANDOM_ATTEMPTS, SEEK_SCALE, Category, Question, QuestionRow)
+from . import QUESTIONS_PER_PAGE, create_app
+from .responses import COMPRESSIBLE_MIMETYPES, brotli, orjson
+
+"""
+Async serving mode
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 4
+
+create_asgi_app(test_config=None) builds the Flask app as create_app does
+and wraps it in an ASGI app. The read endpoints that carry most of the
+traffic, GET /categories, GET /questions, GET /categories/<id>/questions
+and the random and prefetch modes of POST /quizzes, are served on the
+event loop with an async driver (see async_db.py), so a worker waits on
+many queries at once instead of holding a thread per query. Every other
+request, writes included, is handed to the Flask app on a thread pool of
+ASGI_WSGI_THREADS threads, so the routes and JSON contracts are those of
+flaskr in both modes.
+"""
+# chunks of a flaskr response waiting to be sent
+WSGI_QUEUE_SIZE = 8
+ERROR_MESSAGES = {404: 'Not found', 422: 'unprocessable', 500: 'Server Side Error'}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status):
+        super(HTTPError, self).__init__(status)
+        self.status = status
+
+
+class Request(object):
+    __slots__ = ('scope', 'method', 'path', 'args', 'headers', 'body')
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = dict((key, values[-1]) for key, values in
+                         parse_qs(scope['query_string'].decode('latin-1')).items())
+        self.headers = {}
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.headers[name] = self.headers[name] + ',' + value if name in self.headers else value
+        self.body = body
+
+    def arg(self, name, default=None):
+        # like request.args.get(name, default, type=int)
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            raise HTTPError(400)
+
+
+class Response(object):
+    __slots__ = ('status', 'body', 'headers', 'compress')
+
+    def __init__(self, status=200, body=b'', headers=None, compress=True):
+        self.status = status
+        self.body = body
+        self.headers = headers or []
+        self.compress = compress
+
+
+def _accepts(request, encoding):
+    for item in request.headers.get('accept-encoding', '').split(','):
+        name, _, parameters = item.strip().partition(';')
+        if name.strip() in (encoding, '*'):
+            return 'q=0' not in parameters.replace(' ', '') or 'q=0.' in parameters
+    return False
+
+
+def _http_date(value):
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def _datetime(value):
+    # sqlite returns DateTime columns as text
+    if isinstance(value, str):
+        return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+    return value.replace(tzinfo=None) if value is not None else None
+
+
+class AsyncTriviaApp(object):
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.db = AsyncDatabase(self.config['SQLALCHEMY_DATABASE_URI'],
+                                pool_size=self.config['ASGI_POOL_SIZE'],
+                                statement_timeout=self.config['DB_STATEMENT_TIMEOUT'])
+        self.executor = ThreadPoolExecutor(self.config['ASGI_WSGI_THREADS'])
+        self.routes = {
+            ('GET', ('categories',)): self.get_categories,
+            ('GET', ('questions',)): self.get_questions,
+            ('GET', ('categories', None, 'questions')): self.get_questions_by_category_id,
+            ('POST', ('quizzes',)): self.get_quizzes,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        body = []
+        while True:
+            message = await receive()
+            body.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        request = Request(scope, b''.join(body))
+
+        view, arguments = self.match(request)
+        response = None
+        if view is not None:
+            try:
+                response = await view(request, *arguments)
+            except HTTPError as error:
+                response = self.error(error.status)
+            except Exception:
+                self.flask_app.logger.exception('Async request failed: %s %s', request.method, request.path)
+                response = self.error(500)
+        if response is None:
+            # any other route, or a mode served by flaskr only
+            return await self.wsgi(request, send)
+        await self.send(request, response, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.db.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def match(self, request):
+        method = 'GET' if request.method == 'HEAD' else request.method
+        parts = tuple(request.path.strip('/').split('/'))
+        if (method, parts) in self.routes:
+            return self.routes[(method, parts)], ()
+        if len(parts) == 3 and parts[1].isdigit():
+            view = self.routes.get((method, (parts[0], None, parts[2])))
+            if view is not None:
+                return view, (int(parts[1]),)
+        return None, ()
+
+    # responses
+
+    def dumps(self, payload):
+        if orjson is not None and self.config['JSON_SERIALIZER'] == 'orjson':
+            return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+        return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    def json(self, payload, status=200, compress=True):
+        return Response(status, self.dumps(payload), [('Content-Type', 'application/json')], compress)
+
+    def error(self, status):
+        return self.json({
+            "success": False,
+            "error": status,
+            "message": ERROR_MESSAGES.get(status, 'Bad Request')
+            }, status)
+
+    async def conditional(self, request, names, view):
+        # as flaskr.responses.conditional
+        versions = dict((name, (0, None)) for name in names)
+        for name, version, updated_at in await self.db.fetch(data_versions_statement(names)):
+            versions[name] = (version, _datetime(updated_at))
+        etag = 'v' + '.'.join(str(versions[name][0]) for name in names)
+        modified = [updated_at for version, updated_at in versions.values() if updated_at]
+        modified_at = max(modified) if modified else None
+        last_modified = modified_at.replace(microsecond=0) if modified else None
+
+        matched = self.not_modified(request, etag, modified_at)
+        if matched:
+            response = Response(304)
+            # the tag of the stored representation, as flaskr does
+            response.headers.append(('Vary', 'Accept-Encoding'))
+            etag = matched if matched is not True else etag
+        else:
+            response = await view()
+            if response.status != 200:
+                return response
+        response.headers.append(('ETag', '"{}"'.format(etag)))
+        if last_modified is not None:
+            response.headers.append(('Last-Modified', _http_date(last_modified)))
+        return response
+
+    def not_modified(self, request, etag, modified_at):
+        # the tag of If-None-Match that matched, True for * and If-Modified-Since
+        if 'if-none-match' in request.headers:
+            tags = [tag.strip().lstrip('W/').strip('"') for tag in request.headers['if-none-match'].split(',')]
+            if '*' in tags:
+                return True
+            matches = sorted(tag for tag in tags if tag.split('-')[0] == etag)
+            if brotli is not None and _accepts(request, 'br'):
+                encoded = etag + '-br'
+            else:
+                encoded = etag + '-gzip' if _accepts(request, 'gzip') else None
+            return encoded if encoded in matches else (matches[0] if matches else None)
+        if 'if-modified-since' in request.headers and modified_at is not None:
+            try:
+                since = parsedate_to_datetime(request.headers['if-modified-since'])
+            except (TypeError, ValueError):
+                return False
+            # the exact write time, as Last-Modified drops fractions of a second
+            return modified_at <= since.replace(tzinfo=None)
+        return False
+
+    def compress(self, request, response):
+        # as flaskr.responses.compress_response
+        content_type = dict(response.headers).get('Content-Type', '')
+        if (not response.compress or not self.config['COMPRESS_ENABLED'] or response.status != 200
+                or content_type.split(';')[0] not in COMPRESSIBLE_MIMETYPES):
+            return
+        response.headers.append(('Vary', 'Accept-Encoding'))
+        if len(response.body) < self.config['COMPRESS_MIN_SIZE']:
+            return
+        level = self.config['COMPRESS_LEVEL']
+        if brotli is not None and _accepts(request, 'br'):
+            encoding, response.body = 'br', brotli.compress(response.body, quality=level)
+        elif _accepts(request, 'gzip'):
+            encoding, response.body = 'gzip', gzip.compress(response.body, compresslevel=level)
+        else:
+            return
+        response.headers = [(name, value[:-1] + '-' + encoding + '"' if name == 'ETag' else value)
+                             for name, value in response.headers]
+        response.headers.append(('Content-Encoding', encoding))
+
+    async def send(self, request, response, send):
+        self.compress(request, response)
+        headers = response.headers + [
+            ('Content-Length', str(len(response.body))),
+            ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+            ('Access-Control-Allow-Headers', 'GET, POST, PATCH, DELETE, OPTIONS'),
+        ]
+        if 'origin' in request.headers:
+            headers.append(('Access-Control-Allow-Origin', '*'))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+        await send({'type': 'http.response.body',
+                    'body': response.body if request.method != 'HEAD' else b''})
+
+    # flaskr, on the thread pool
+
+    def environ(self, request):
+        scope = request.scope
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(request.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'CONTENT_LENGTH': str(len(request.body)),
+        }
+        for name, value in request.headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'content-length':
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+
+    async def wsgi(self, request, send):
+        # the response is produced by one thread, as streamed views keep
+        # their request context there, and handed over a bounded queue
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(WSGI_QUEUE_SIZE)
+        closed = threading.Event()
+
+        def put(item):
+            if not closed.is_set():
+                asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put((int(status.split(' ', 1)[0]), headers))
+
+        def run():
+            iterable = None
+            try:
+                iterable = self.flask_app(self.environ(request), start_response)
+                for chunk in iterable:
+                    if closed.is_set():
+                        break
+                    if chunk:
+                        put(chunk)
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+                put(None)
+
+        running = loop.run_in_executor(self.executor, run)
+        try:
+            started = await chunks.get()
+            if started is None:
+                # the app failed before starting a response
+                return await running
+            status, headers = started
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            })
+            chunk = await chunks.get()
+            if chunk is None:
+                await send({'type': 'http.response.body', 'body': b''})
+            while chunk is not None:
+                following = await chunks.get()
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': following is not None})
+                chunk = following
+        finally:
+            closed.set()
+            while not chunks.empty():
+                chunks.get_nowait()
+            await running
+
+    # endpoints served on the event loop
+
+    async def categories(self):
+        rows = await self.db.fetch(select([Category.id, Category.type]).order_by(Category.id))
+        return dict((str(id), type) for id, type in rows)
+
+    async def page(self, request, criteria=()):
+        criteria = list(criteria)
+        offset = 0
+        after_id = request.arg('after_id')
+        if after_id is not None:
+            criteria.append(Question.id > after_id)
+        else:
+            offset = max(request.arg('page', 1) - 1, 0) * QUESTIONS_PER_PAGE
+        rows = await self.db.fetch(questions_statement(criteria, offset=offset, limit=QUESTIONS_PER_PAGE))
+        return [QuestionRow(*row).format() for row in rows]
+
+    async def count(self, criteria=()):
+        return (await self.db.fetch(count_statement(criteria)))[0][0]
+
+    async def get_categories(self, request):
+        async def view():
+            return self.json({'categories': await self.categories()})
+        return await self.conditional(request, ('categories',), view)
+
+    async def get_questions(self, request):
+        async def view():
+            questions, total, categories = await asyncio.gather(
+                self.page(request), self.count(), self.categories())
+            if len(questions) == 0:
+                raise HTTPError(422)
+            return self.json({
+                'questions': questions,
+                'total_questions': total,
+                'categories': categories,
+                'current_category': None
+                })
+        return await self.conditional(request, ('questions', 'categories'), view)
+
+    async def get_questions_by_category_id(self, request, category_id):
+        async def view():
+            criteria = [Question.category == category_id]
+            categories, questions, total = await asyncio.gather(
+                self.categories(), self.page(request, criteria), self.count(criteria))
+            if str(category_id) not in categories:
+                raise HTTPError(404)
+            return self.json({
+                "questions": questions,
+                "total_questions": total,
+                "current_category": categories[str(category_id)]
+                })
+        return await self.conditional(request, ('questions', 'categories'), view)
+
+    async def random_question(self, category, exclude):
+        # models.random_question
+        criteria = [Question.category == category] if category is not None else []
+        low, high = (await self.db.fetch(id_range_statement(criteria)))[0]
+        if low is None:
+            return None
+
+        exclude = set(int(question_id) for question_id in exclude)
+        for _ in range(RANDOM_ATTEMPTS):
+            point = random.randint(low, high)
+            row = (await self.db.fetch(questions_statement(criteria + [Question.id >= point], limit=1)))[0]
+            if row[0] not in exclude:
+                return QuestionRow(*row)
+
+        criteria.append(Question.id.notin_(sorted(exclude)))
+        rows = (await self.db.fetch(questions_statement(criteria + [Question.id >= point], limit=1))
+                or await self.db.fetch(questions_statement(criteria + [Question.id < point], limit=1)))
+        return QuestionRow(*rows[0]) if rows else None
+
+    async def random_questions(self, count, category, exclude):
+        # models.random_questions
+        exclude = sorted(set(int(question_id) for question_id in exclude))
+        parameters = dict(('point_{}'.format(index), random.randrange(SEEK_SCALE)) for index in range(count * 2))
+        parameters.update(category=category, exclude=exclude)
+        statement = random_seeks(count * 2, category is not None, bool(exclude))
+        rows = await self.db.fetch(statement, parameters, cache=True)
+
+        questions = {}
+        for row in rows:
+            if len(questions) < count:
+                questions.setdefault(row[0], QuestionRow(*row))
+        if len(questions) < count:
+            criteria = [Question.id.notin_(exclude + list(questions))] if exclude or questions else []
+            if category is not None:
+                criteria.append(Question.category == category)
+            rows = await self.db.fetch(questions_statement(criteria, limit=count - len(questions)))
+            questions.update((row[0], QuestionRow(*row)) for row in rows)
+
+        questions = list(questions.values())
+        random.shuffle(questions)
+        return questions
+
+    async def get_quizzes(self, request):
+        body = request.json()
+        if not isinstance(body, dict) or body.get('session_id') is not None or body.get('session', False):
+            # session mode keeps its state in flaskr
+            return None
+        if body.get('difficulty') is not None or body.get('correct_answers') is not None:
+            # the difficulty modes draw from the quiz buckets of flaskr
+            return None
+
+        previous_questions = body.get('previous_questions', [])
+        quiz_category = body.get('quiz_category', None)
+        if (previous_questions is None) or (quiz_category is None):
+            raise HTTPError(404)
+        count = body.get('count', None)
+        if count is not None and not (isinstance(count, int)
+                                      and 0 < count <= self.config['QUIZ_PREFETCH_MAX']):
+            raise HTTPError(422)
+        try:
+            category_id = int(quiz_category['id'])
+            exclude = [int(question_id) for question_id in previous_questions]
+        except Exception:
+            raise HTTPError(500)
+
+        if count is None:
+            question = await self.random_question(category_id or None, exclude)
+            return self.json({
+                "question": question.format() if question else None
+                }, compress=False)
+
+        questions = await self.random_questions(count, category_id or None, exclude)
+        formatted_question = [question.format() for question in questions]
+        return self.json({
+            "question": formatted_question[0] if formatted_question else None,
+            "questions": formatted_question
+            }, compress=False)
+
+"""
+create_asgi_app(test_config=None)
+    the ASGI application of the async serving mode
+"""
+def create_asgi_app(test_config=None):
+    return AsyncTriviaApp(create_app(test_config))
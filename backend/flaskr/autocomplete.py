@@ -0,0 +1,224 @@
+import heapq
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy import select
+
+from models import db, data_versions, Question
+
+TOKEN = re.compile(r'\w+')
+# a prefix completing to more tokens than this has its suggestions cached,
+# instead of merging the postings of every completion on each keystroke
+MERGE_LIMIT = 64
+ID_BITS = 32
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def _words(text):
+    # the distinct words of a question, stored once however many use them;
+    # the question column is nullable, a question without text has none
+    return tuple(sorted(set(sys.intern(token) for token in tokenize(text or ''))))
+
+
+def _rank(question_id, text):
+    # shorter questions first, then by id: one integer that sorts both ways
+    return (len(text or '') << ID_BITS) | question_id
+
+"""
+AutocompleteIndex(limit=10, refresh=5)
+    an in-process index of the words of Question.question answering
+    search-as-you-type queries without touching the database.
+
+    The distinct words are kept in one sorted list, so the words starting
+    with a prefix are a bisect away, and each word has a sorted array of
+    the ranks of its questions, a rank packing the question length and id
+    so that the first entries are the best suggestions. The typed words
+    but the last must appear in a question, the last one may be a prefix.
+
+    The index is built by the first query, not before the first request,
+    so that a failed build only fails autocomplete, and it is tagged with
+    the questions data version, like QuestionStats: writes through this process are applied
+    by question_listener, and the version is read again at most every
+    refresh seconds to notice writes from elsewhere.
+"""
+class AutocompleteIndex(object):
+
+    def __init__(self, limit=10, refresh=5):
+        self.limit = limit
+        self.refresh = refresh
+        self.version = None
+        self.checked = 0.0
+        self.builds = 0
+        self._questions = {}
+        self._postings = {}
+        self._tokens = []
+        self._top = {}
+        self._lock = threading.Lock()
+
+    def build(self, version=None):
+        if version is None:
+            version = data_versions(['questions'])['questions'][0]
+        questions = {}
+        postings = {}
+        statement = select([Question.id, Question.question, Question.category])
+        for question_id, text, category in db.session.execute(statement):
+            tokens = _words(text)
+            questions[question_id] = (text, category, tokens)
+            rank = _rank(question_id, text)
+            for token in tokens:
+                postings.setdefault(token, []).append(rank)
+        for token, ranks in postings.items():
+            postings[token] = array('q', sorted(ranks))
+        with self._lock:
+            self._questions = questions
+            self._postings = postings
+            self._tokens = sorted(postings)
+            self._top = {}
+            self.version = version
+            self.checked = time.monotonic()
+            self.builds += 1
+
+    def _current(self):
+        if self.version is not None and time.monotonic() - self.checked < self.refresh:
+            return
+        version = data_versions(['questions'])['questions'][0]
+        if version != self.version:
+            self.build(version)
+        else:
+            self.checked = time.monotonic()
+
+    def _add(self, question_id, text, category):
+        tokens = _words(text)
+        self._questions[question_id] = (text, category, tokens)
+        rank = _rank(question_id, text)
+        for token in tokens:
+            if token not in self._postings:
+                self._postings[token] = array('q')
+                insort(self._tokens, token)
+            insort(self._postings[token], rank)
+            self._forget(token)
+
+    def _remove(self, question_id):
+        entry = self._questions.pop(question_id, None)
+        if entry is None:
+            return
+        text, category, tokens = entry
+        rank = _rank(question_id, text)
+        for token in tokens:
+            ranks = self._postings[token]
+            del ranks[bisect_left(ranks, rank)]
+            if not ranks:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+            self._forget(token)
+
+    def _forget(self, token):
+        # the cached suggestions of every prefix of token may have changed
+        for length in range(1, len(token) + 1):
+            self._top.pop(token[:length], None)
+
+    def _completions(self, prefix):
+        start = bisect_left(self._tokens, prefix)
+        end = bisect_left(self._tokens, prefix + '\U0010ffff', start)
+        return self._tokens[start:end]
+
+    def _prefix_ranks(self, prefix, limit):
+        # the best ranks of the questions with a word starting with prefix
+        completions = self._completions(prefix)
+        cached = len(completions) > MERGE_LIMIT
+        if cached and prefix in self._top:
+            return self._top[prefix][:limit]
+        ranks = []
+        for rank in heapq.merge(*(self._postings[token] for token in completions)):
+            if not ranks or ranks[-1] != rank:
+                ranks.append(rank)
+                if len(ranks) == (self.limit if cached else limit):
+                    break
+        if cached:
+            self._top[prefix] = ranks
+        return ranks[:limit]
+
+    def _filtered_ranks(self, words, prefix, limit):
+        # the best questions having every word, intersected from the
+        # rarest one on, and a word starting with prefix
+        postings = sorted((self._postings.get(word) for word in set(words)), key=lambda ranks: len(ranks or ()))
+        if not postings[0]:
+            return []
+        if len(postings) == 1:
+            # already in rank order, so the scan stops at the limit
+            ranks = postings[0]
+        else:
+            ranks = set(postings[0])
+            for other in postings[1:]:
+                ranks.intersection_update(other)
+            ranks = sorted(ranks)
+        mask = (1 << ID_BITS) - 1
+        best = []
+        for rank in ranks:
+            if not prefix or any(token.startswith(prefix) for token in self._questions[rank & mask][2]):
+                best.append(rank)
+                if len(best) == limit:
+                    break
+        return best
+
+    def suggest(self, text, limit=None):
+        limit = min(limit or self.limit, self.limit)
+        words = tokenize(text)
+        if not words:
+            return []
+        # a word still being typed is completed, one followed by a space is not
+        prefix = words.pop() if TOKEN.match(text[-1]) else None
+        self._current()
+        with self._lock:
+            if words:
+                ranks = self._filtered_ranks(words, prefix, limit)
+            else:
+                ranks = self._prefix_ranks(prefix, limit)
+            suggestions = []
+            for rank in ranks:
+                question_id = rank & ((1 << ID_BITS) - 1)
+                question, category, tokens = self._questions[question_id]
+                suggestions.append({'id': question_id, 'question': question, 'category': category})
+        return suggestions
+
+    def question_listener(self, action, questions, previous):
+        if self.version is None:
+            return
+        version = data_versions(['questions'])['questions'][0]
+        with self._lock:
+            if action == 'import' or version != self.version + 1:
+                self.version = None
+                return
+            for question in previous or ():
+                self._remove(question['id'])
+            for question in questions:
+                self._remove(question['id'])
+                if action != 'delete':
+                    self._add(question['id'], question['question'], question['category'])
+            self.version = version
+
+    def stats(self):
+        # approximate: the containers, strings and numbers the index holds
+        with self._lock:
+            size = sum(sys.getsizeof(container) for container in
+                       (self._questions, self._postings, self._tokens, self._top))
+            size += sum(sys.getsizeof(token) + sys.getsizeof(ranks) for token, ranks in self._postings.items())
+            for question_id, entry in self._questions.items():
+                size += sys.getsizeof(question_id) + sys.getsizeof(entry)
+                size += sys.getsizeof(entry[0]) + sys.getsizeof(entry[2])
+            size += sum(sys.getsizeof(prefix) + sys.getsizeof(ranks) for prefix, ranks in self._top.items())
+            return {
+                'questions': len(self._questions),
+                'tokens': len(self._tokens),
+                'postings': sum(len(ranks) for ranks in self._postings.values()),
+                'cached_prefixes': len(self._top),
+                'memory_bytes': size,
+                'builds': self.builds
+            }
@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+
+from sqlalchemy import select
+
+from models import db, data_versions, Question
+
+# random picks tried before a bucket mostly made of excluded ids is scanned
+SAMPLE_ATTEMPTS = 8
+
+"""
+Bucket
+    a set of question ids that can also be sampled in O(1): the ids sit in
+    a list and their positions in a dict, so removing one swaps the last
+    id into its place
+"""
+class Bucket(object):
+    __slots__ = ('ids', 'positions')
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def add(self, question_id):
+        if question_id not in self.positions:
+            self.positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if last != question_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def sample(self, exclude):
+        for _ in range(SAMPLE_ATTEMPTS):
+            if not self.ids:
+                return None
+            question_id = self.ids[random.randrange(len(self.ids))]
+            if question_id not in exclude:
+                return question_id
+        left = [question_id for question_id in self.ids if question_id not in exclude]
+        return random.choice(left) if left else None
+
+    def __len__(self):
+        return len(self.ids)
+
+"""
+QuestionBuckets(refresh=5)
+    the question ids by (category, difficulty), and by (None, difficulty)
+    for quizzes over every category, kept in memory to draw quiz questions
+    of a given difficulty without a query.
+
+    Like AutocompleteIndex, the buckets are built on first use, patched by
+    question_listener for writes through this process and built again
+    when the questions version, read at most every refresh seconds, shows
+    writes from elsewhere.
+"""
+class QuestionBuckets(object):
+
+    def __init__(self, refresh=5):
+        self.refresh = refresh
+        self.version = None
+        self.checked = 0.0
+        self.builds = 0
+        self._buckets = {}
+        self._cells = {}
+        self._lock = threading.Lock()
+
+    def build(self, version=None):
+        if version is None:
+            version = data_versions(['questions'])['questions'][0]
+        buckets = {}
+        cells = {}
+        statement = select([Question.id, Question.category, Question.difficulty])
+        for question_id, category, difficulty in db.session.execute(statement):
+            cells[question_id] = (category, difficulty)
+            for key in ((category, difficulty), (None, difficulty)):
+                buckets.setdefault(key, Bucket()).add(question_id)
+        with self._lock:
+            self._buckets = buckets
+            self._cells = cells
+            self.version = version
+            self.checked = time.monotonic()
+            self.builds += 1
+
+    def _current(self):
+        if self.version is not None and time.monotonic() - self.checked < self.refresh:
+            return
+        version = data_versions(['questions'])['questions'][0]
+        if version != self.version:
+            self.build(version)
+        else:
+            self.checked = time.monotonic()
+
+    def _add(self, question_id, category, difficulty):
+        self._cells[question_id] = (category, difficulty)
+        for key in ((category, difficulty), (None, difficulty)):
+            self._buckets.setdefault(key, Bucket()).add(question_id)
+
+    def _remove(self, question_id):
+        cell = self._cells.pop(question_id, None)
+        if cell is None:
+            return
+        category, difficulty = cell
+        for key in ((category, difficulty), (None, difficulty)):
+            self._buckets[key].remove(question_id)
+
+    def difficulties(self, category=None):
+        # the difficulties the category has questions of, easiest first
+        self._current()
+        with self._lock:
+            return sorted(difficulty for (cell_category, difficulty), bucket in self._buckets.items()
+                          if cell_category == category and difficulty is not None and len(bucket))
+
+    def ramp(self, category=None, correct_answers=0):
+        # one difficulty up per correct answer, from the easiest one
+        difficulties = self.difficulties(category)
+        if not difficulties:
+            return None
+        return difficulties[min(correct_answers, len(difficulties) - 1)]
+
+    def draw(self, count, category, difficulty, exclude=()):
+        # up to count distinct ids of the difficulty, then of the nearest ones
+        self._current()
+        exclude = set(int(question_id) for question_id in exclude)
+        drawn = []
+        with self._lock:
+            levels = sorted((level for (cell_category, level), bucket in self._buckets.items()
+                             if cell_category == category and level is not None and len(bucket)),
+                            key=lambda level: (abs(level - difficulty), -level))
+            for nearest in levels:
+                bucket = self._buckets[(category, nearest)]
+                while len(drawn) < count:
+                    question_id = bucket.sample(exclude)
+                    if question_id is None:
+                        break
+                    drawn.append(question_id)
+                    exclude.add(question_id)
+                if len(drawn) == count:
+                    break
+        return drawn
+
+    def question_listener(self, action, questions, previous):
+        if self.version is None:
+            return
+        version = data_versions(['questions'])['questions'][0]
+        with self._lock:
+            if action == 'import' or version != self.version + 1:
+                self.version = None
+                return
+            for question in questions:
+                self._remove(question['id'])
+                if action != 'delete':
+                    self._add(question['id'], question['category'], question['difficulty'])
+            self.version = version
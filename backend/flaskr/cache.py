@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+LRUCache(maxsize, ttl=None, sizeof=None)
+    a thread safe least-recently-used mapping; entries older than ttl
+    seconds are dropped when they are read, and the least recently used
+    entry is evicted once more than maxsize entries are stored. With
+    sizeof, maxsize bounds the sum of sizeof(value) instead, e.g. bytes.
+
+    clear() bumps generation; passing the generation read before computing
+    a value to set() drops values computed from data cleared meanwhile
+"""
+class LRUCache(object):
+
+    def __init__(self, maxsize=1024, ttl=None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._store(key, value)
+
+    def _weight(self, value):
+        return self.sizeof(value) if self.sizeof is not None else 1
+
+    def _store(self, key, value):
+        # called with the lock held
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._drop(key)
+        weight = self._weight(value)
+        if weight > self.maxsize:
+            return
+        self._entries[key] = (expires, value)
+        self.weight += weight
+        while self.weight > self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.weight -= self._weight(entry[1])
+        return entry
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._drop(key)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+"""
+ResponseCache(maxbytes, ttl=None)
+    an LRUCache of rendered response bodies bounded by their total size in
+    bytes. Entries carry tags, e.g. the category of a page, and
+    invalidate(tags) drops every entry having one of them.
+
+    get_or_compute(key, compute, tags, version) returns the cached body or
+    computes it; concurrent misses of one key wait for the first one to
+    compute it instead of computing it again. version is the data version
+    the caller read: a newer one empties the cache, which was filled from
+    older data, and an older one is served uncached. A body computed while
+    one of its tags was invalidated is not stored.
+"""
+class ResponseCache(LRUCache):
+
+    def __init__(self, maxbytes, ttl=None):
+        LRUCache.__init__(self, maxbytes, ttl, sizeof=lambda entry: len(entry[0]))
+        self.version = None
+        self.waits = 0
+        self._tags = {}
+        self._pending = {}
+
+    def get_or_compute(self, key, compute, tags=(), version=None):
+        while True:
+            with self._lock:
+                if version is not None and (self.version is None or version > self.version):
+                    self._reset(version)
+                elif version is not None and version < self.version:
+                    return compute()
+                entry = self._entries.get(key)
+                if entry is not None and (entry[0] is None or entry[0] >= time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1][0]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    generations = (self.generation, tuple(self._tags.get(tag, 0) for tag in tags))
+                    break
+                self.waits += 1
+            # the first miss stored the body, or failed and the next one computes it
+            pending.wait()
+
+        try:
+            body = compute()
+            with self._lock:
+                if generations == (self.generation, tuple(self._tags.get(tag, 0) for tag in tags)):
+                    self._store(key, (body, tuple(tags)))
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return body
+
+    def invalidate(self, tags, version=None):
+        tags = set(tags)
+        with self._lock:
+            if version is not None and (self.version is None or version != self.version + 1):
+                # writes from elsewhere happened in between
+                self._reset(version)
+                return
+            for tag in tags:
+                self._tags[tag] = self._tags.get(tag, 0) + 1
+            for key in [key for key, (expires, entry) in self._entries.items() if tags.intersection(entry[1])]:
+                self._drop(key)
+            if version is not None:
+                self.version = version
+
+    def _reset(self, version):
+        # called with the lock held
+        self.generation += 1
+        self._entries.clear()
+        self.weight = 0
+        self.version = version
+
+    def stats(self):
+        stats = LRUCache.stats(self)
+        stats.update(bytes=self.weight, waits=self.waits)
+        return stats
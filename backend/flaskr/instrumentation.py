@@ -0,0 +1,220 @@
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import category_registry, db, pool_stats
+
+# upper bounds, in seconds, of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# slow request profiles kept for GET /metrics/slow
+SLOW_PROFILES = 50
+
+"""
+RequestStats
+    what one request spent: SQL queries, their time and rows, JSON
+    serialization and, when profiled, stack samples
+"""
+class RequestStats(object):
+    __slots__ = ('start', 'queries', 'sql_time', 'rows', 'serialization', 'samples')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.serialization = 0.0
+        self.samples = Counter()
+
+
+def current_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if current_stats() is not None:
+        connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    if stats is None or not connection.info.get('query_start'):
+        return
+    stats.queries += 1
+    stats.sql_time += time.perf_counter() - connection.info['query_start'].pop()
+    # drivers report -1 when they do not know, e.g. sqlite for SELECTs
+    stats.rows += max(cursor.rowcount, 0)
+
+
+class RouteMetrics(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.queries = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.serialization = 0.0
+        self.statuses = Counter()
+
+    def add(self, stats, duration, status):
+        self.requests += 1
+        self.duration += duration
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+        self.queries += stats.queries
+        self.sql_time += stats.sql_time
+        self.rows += stats.rows
+        self.serialization += stats.serialization
+        self.statuses[status] += 1
+
+
+"""
+Sampler
+    a background thread that samples, every interval seconds, the stack of
+    each thread serving a request and adds it to that request's samples
+"""
+class Sampler(threading.Thread):
+
+    def __init__(self, interval):
+        super(Sampler, self).__init__(name='request-sampler', daemon=True)
+        self.interval = interval
+        self.active = {}
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, stats in list(self.active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stats.samples[_collapse(frame)] += 1
+
+
+def _collapse(frame, depth=40):
+    stack = []
+    while frame is not None and len(stack) < depth:
+        code = frame.f_code
+        stack.append('{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+"""
+Instrumentation(app)
+    per route request metrics, Server-Timing headers and, when
+    PROFILE_SLOW_REQUESTS_MS is set, stack samples of slow requests
+"""
+class Instrumentation(object):
+
+    def __init__(self, app):
+        self.routes = {}
+        self.slow = deque(maxlen=SLOW_PROFILES)
+        self._lock = threading.Lock()
+        self.slow_threshold = app.config['PROFILE_SLOW_REQUESTS_MS'] / 1000.0
+        self.sampler = None
+        if self.slow_threshold > 0:
+            self.sampler = Sampler(app.config['PROFILE_INTERVAL_MS'] / 1000.0)
+            self.sampler.start()
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.extensions['instrumentation'] = self
+
+    def before_request(self):
+        g.request_stats = RequestStats()
+        if self.sampler is not None:
+            self.sampler.active[threading.get_ident()] = g.request_stats
+
+    def after_request(self, response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats.start
+        response.headers['Server-Timing'] = (
+            'db;dur={:.2f};desc="{} queries", json;dur={:.2f}, total;dur={:.2f}'.format(
+                stats.sql_time * 1000, stats.queries, stats.serialization * 1000, duration * 1000))
+
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        with self._lock:
+            metrics = self.routes.setdefault((request.method, route), RouteMetrics())
+            metrics.add(stats, duration, response.status_code)
+
+        if self.sampler is not None and duration >= self.slow_threshold:
+            self.sampler.active.pop(threading.get_ident(), None)
+            self.slow.append({
+                'method': request.method,
+                'path': request.full_path,
+                'duration': duration,
+                'queries': stats.queries,
+                'sql_time': stats.sql_time,
+                'stacks': stats.samples.most_common(10)
+            })
+            current_app.logger.warning('Slow request %s %s took %.0f ms, %d queries',
+                                       request.method, request.full_path, duration * 1000, stats.queries)
+        return response
+
+    def teardown_request(self, exception):
+        if self.sampler is not None:
+            self.sampler.active.pop(threading.get_ident(), None)
+
+    def prometheus(self):
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append('# HELP trivia_{} {}'.format(name, description))
+            lines.append('# TYPE trivia_{} {}'.format(name, kind))
+            for sample in samples:
+                suffix, labels, value = sample if len(sample) == 3 else ('',) + sample
+                label_text = ','.join('{}="{}"'.format(key, label) for key, label in labels)
+                lines.append('trivia_{}{}{} {}'.format(
+                    name, suffix, '{' + label_text + '}' if labels else '', value))
+
+        with self._lock:
+            routes = sorted(self.routes.items())
+            labelled = [((('method', method), ('route', route)), metrics) for (method, route), metrics in routes]
+
+            metric('responses_total', 'counter', 'Responses by route and status',
+                   [(labels + (('status', status),), count)
+                    for labels, metrics in labelled for status, count in sorted(metrics.statuses.items())])
+            histogram = []
+            for labels, metrics in labelled:
+                for bound, count in zip(DURATION_BUCKETS, metrics.buckets):
+                    histogram.append(('_bucket', labels + (('le', bound),), count))
+                histogram.append(('_bucket', labels + (('le', '+Inf'),), metrics.requests))
+                histogram.append(('_sum', labels, metrics.duration))
+                histogram.append(('_count', labels, metrics.requests))
+            metric('request_duration_seconds', 'histogram', 'Request wall time', histogram)
+            metric('sql_queries_total', 'counter', 'SQL queries issued',
+                   [(labels, metrics.queries) for labels, metrics in labelled])
+            metric('sql_duration_seconds_total', 'counter', 'Time spent in SQL',
+                   [(labels, metrics.sql_time) for labels, metrics in labelled])
+            metric('sql_rows_total', 'counter', 'Rows reported by the driver',
+                   [(labels, metrics.rows) for labels, metrics in labelled])
+            metric('serialization_seconds_total', 'counter', 'Time spent encoding JSON',
+                   [(labels, metrics.serialization) for labels, metrics in labelled])
+
+        categories = category_registry.stats()
+        metric('category_cache_total', 'counter', 'Category registry lookups',
+               [((('result', 'hit'),), categories['hits']), ((('result', 'miss'),), categories['misses'])])
+        responses = current_app.extensions['response_cache'].stats()
+        metric('response_cache_total', 'counter', 'Rendered page lookups, waits for a page being rendered',
+               [((('result', result),), responses[key]) for result, key in
+                (('hit', 'hits'), ('miss', 'misses'), ('wait', 'waits'))])
+        metric('response_cache_bytes', 'gauge', 'Bytes of rendered pages held', [((), responses['bytes'])])
+        pool = pool_stats(db.get_engine(current_app))
+        metric('db_pool_connections', 'gauge', 'Connections of the pool by state',
+               [((('state', key),), pool[key]) for key in ('checked_in', 'checked_out', 'overflow') if key in pool])
+        if 'wait_time' in pool:
+            metric('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection',
+                   [((), pool['wait_time'])])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,104 @@
+import random
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models import db, QuizSession, QuizSessionQuestion
+from .cache import LRUCache
+
+"""
+Quiz session stores
+
+    create(question_ids) shuffles the ids, keeps them under a new session
+    id and returns that id; pop(session_id) hands out the next id of the
+    shuffled order in O(1), None once the quiz is exhausted, and raises
+    KeyError for unknown or expired sessions.
+"""
+def shuffled(question_ids, limit):
+    order = list(question_ids)
+    random.shuffle(order)
+    return order[:limit]
+
+
+class MemorySessionStore(object):
+    """Keeps sessions in this process, in an LRU with a TTL."""
+
+    def __init__(self, maxsize=10000, ttl=3600, max_questions=1000):
+        self.sessions = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.max_questions = max_questions
+        self._lock = threading.Lock()
+
+    def create(self, question_ids):
+        order = shuffled(question_ids, self.max_questions)
+        session_id = uuid.uuid4().hex
+        self.sessions.set(session_id, order)
+        return session_id
+
+    def pop(self, session_id):
+        order = self.sessions.get(session_id)
+        if order is None:
+            raise KeyError(session_id)
+        with self._lock:
+            return order.pop() if order else None
+
+
+class DatabaseSessionStore(object):
+    """Keeps sessions in the quiz_sessions table so every worker sees them,
+    one row of quiz_session_questions per position of their order."""
+
+    def __init__(self, ttl=3600, max_questions=1000):
+        self.ttl = ttl
+        self.max_questions = max_questions
+
+    def create(self, question_ids):
+        order = shuffled(question_ids, self.max_questions)
+        now = datetime.utcnow()
+        expired = select([QuizSession.id]).where(QuizSession.expires_at < now)
+        QuizSessionQuestion.query.filter(QuizSessionQuestion.session_id.in_(expired)) \
+            .delete(synchronize_session=False)
+        QuizSession.query.filter(QuizSession.expires_at < now).delete(synchronize_session=False)
+        session_id = uuid.uuid4().hex
+        db.session.execute(QuizSession.__table__.insert(),
+                           {'id': session_id, 'position': 0, 'expires_at': now + timedelta(seconds=self.ttl)})
+        if order:
+            db.session.execute(QuizSessionQuestion.__table__.insert(),
+                               [{'session_id': session_id, 'position': position, 'question_id': question_id}
+                                for position, question_id in enumerate(order)])
+        db.session.commit()
+        return session_id
+
+    def pop(self, session_id):
+        session = QuizSession.query.filter(QuizSession.id == session_id) \
+            .filter(QuizSession.expires_at >= datetime.utcnow()) \
+            .with_for_update().one_or_none()
+        if session is None:
+            db.session.rollback()
+            raise KeyError(session_id)
+
+        question_id = db.session.query(QuizSessionQuestion.question_id) \
+            .filter(QuizSessionQuestion.session_id == session_id) \
+            .filter(QuizSessionQuestion.position == session.position).scalar()
+        if question_id is None:
+            db.session.rollback()
+            return None
+        session.position += 1
+        db.session.commit()
+        return question_id
+
+
+"""
+make_session_store(config)
+    builds the store named by QUIZ_SESSION_STORE ('memory' or 'database')
+"""
+def make_session_store(config):
+    kind = config['QUIZ_SESSION_STORE']
+    if kind == 'memory':
+        return MemorySessionStore(maxsize=config['QUIZ_SESSION_MAXSIZE'],
+                                  ttl=config['QUIZ_SESSION_TTL'],
+                                  max_questions=config['QUIZ_SESSION_MAX_QUESTIONS'])
+    if kind == 'database':
+        return DatabaseSessionStore(ttl=config['QUIZ_SESSION_TTL'],
+                                    max_questions=config['QUIZ_SESSION_MAX_QUESTIONS'])
+    raise ValueError('Unknown QUIZ_SESSION_STORE {!r}'.format(kind))
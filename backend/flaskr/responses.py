@@ -0,0 +1,204 @@
+import gzip
+import json
+import time
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+
+from models import data_versions
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+
+"""
+dumps(payload)
+    encodes payload to JSON bytes with orjson when it is installed and
+    JSON_SERIALIZER is 'orjson', with the standard library otherwise
+"""
+def dumps(payload):
+    start = time.perf_counter()
+    if orjson is not None and current_app.config['JSON_SERIALIZER'] == 'orjson':
+        body = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    else:
+        body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    stats = g.get('request_stats')
+    if stats is not None:
+        stats.serialization += time.perf_counter() - start
+    return body
+
+"""
+jsonify(*args, **kwargs)
+    drop-in replacement of flask.jsonify going through dumps()
+"""
+def jsonify(*args, **kwargs):
+    payload = args[0] if len(args) == 1 else dict(*args, **kwargs)
+    return current_app.response_class(dumps(payload), mimetype='application/json')
+
+"""
+conditional(*names)
+    makes a GET view answer with a strong ETag and a Last-Modified header
+    derived from the versions of the named datasets, and with 304 Not
+    Modified when the client's copy is current, before the view runs; the
+    view finds the versions read in g.data_versions while it runs
+"""
+def conditional(*names):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            versions = data_versions(names)
+            etag = 'v' + '.'.join(str(versions[name][0]) for name in names)
+            modified = [updated_at for version, updated_at in versions.values() if updated_at]
+            modified_at = max(modified) if modified else None
+            last_modified = modified_at.replace(microsecond=0) if modified else None
+
+            matched = _not_modified(etag, modified_at)
+            if matched:
+                response = current_app.response_class(status=304)
+                # the tag of the stored representation, e.g. "v12.1-gzip",
+                # for caches that only reuse a 304 that validates it
+                response.vary.add('Accept-Encoding')
+                etag = matched if matched is not True else etag
+            else:
+                g.data_versions = versions
+                try:
+                    response = make_response(view(*args, **kwargs))
+                finally:
+                    g.pop('data_versions', None)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
+def _not_modified(etag, modified_at):
+    # the tag of If-None-Match that matched, True for If-Modified-Since
+    if request.if_none_match:
+        # compress_response suffixes the ETag with the content encoding
+        matches = sorted(tag for tag in request.if_none_match.as_set() if tag.split('-')[0] == etag)
+        encoded = '{}-{}'.format(etag, _encoding())
+        return encoded if encoded in matches else (matches[0] if matches else None)
+    if request.if_modified_since and modified_at is not None:
+        # Last-Modified drops the fraction of a second, and a later write
+        # in that second would match it: compare the exact write time
+        return modified_at <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+"""
+compress(enabled=True, min_size=None, level=None)
+    overrides COMPRESS_ENABLED, COMPRESS_MIN_SIZE and COMPRESS_LEVEL for
+    one view; it must sit under the route decorator
+"""
+def compress(enabled=True, min_size=None, level=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapper.compression = {'enabled': enabled, 'min_size': min_size, 'level': level}
+        return wrapper
+    return decorator
+
+
+def _encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _options():
+    config = current_app.config
+    view = current_app.view_functions.get(request.endpoint)
+    options = getattr(view, 'compression', {})
+    # an override of 0 is kept, only None falls back to the config
+    return (options.get('enabled', config['COMPRESS_ENABLED']),
+            config['COMPRESS_MIN_SIZE'] if options.get('min_size') is None else options['min_size'],
+            config['COMPRESS_LEVEL'] if options.get('level') is None else options['level'])
+
+"""
+choose_encoding(size)
+    the encoding compress_response would give a body of size bytes in
+    this request, or None, for views storing their bodies compressed
+"""
+def choose_encoding(size):
+    enabled, min_size, level = _options()
+    if not enabled or size < min_size:
+        return None
+    return _encoding()
+
+"""
+encode(body, encoding)
+    body compressed with encoding, 'br' or 'gzip', at this view's level
+"""
+def encode(body, encoding):
+    enabled, min_size, level = _options()
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level)
+
+
+def _tag_encoding(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None:
+        # each encoding is a different representation with its own strong ETag
+        response.set_etag('{}-{}'.format(etag, encoding), weak)
+
+"""
+encoded_response(body, encoding, mimetype='application/json')
+    a response of a body already compressed with encoding, or of a plain
+    one when encoding is None, which compress_response leaves as it is
+"""
+def encoded_response(body, encoding, mimetype='application/json'):
+    response = current_app.response_class(body, mimetype=mimetype)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+        response.encoded = True
+    return response
+
+"""
+compress_response(response)
+    after_request hook encoding responses with brotli or gzip, as the
+    client accepts, once their body reaches the size threshold
+"""
+def compress_response(response):
+    if getattr(response, 'encoded', False):
+        # encoded by the view, its ETag was set since by @conditional
+        response.vary.add('Accept-Encoding')
+        _tag_encoding(response, response.headers['Content-Encoding'])
+        return response
+
+    enabled, min_size, level = _options()
+    # streamed bodies, such as exports, are not buffered to be compressed
+    if (not enabled or response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    body = response.get_data()
+    if encoding is None or len(body) < min_size:
+        return response
+
+    response.set_data(encode(body, encoding))
+    _tag_encoding(response, encoding)
+    return response
@@ -0,0 +1,89 @@
+import threading
+from collections import Counter
+
+from flask import g
+from sqlalchemy import func, select
+
+from models import db, data_versions, Question
+
+"""
+QuestionStats
+    question counts per (category, difficulty), kept in memory and served
+    without counting rows.
+
+    The counts are read with one GROUP BY and tagged with the questions
+    data version they match. Writes made through this process reach
+    question_listener, which applies them as deltas when the version moved
+    by exactly that one write; a version moved by another worker, or by a
+    bulk import, makes the next read load the counts again.
+"""
+class QuestionStats(object):
+
+    def __init__(self):
+        self.version = None
+        self.loads = 0
+        self._cells = Counter()
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        # @conditional views already read the versions of this request
+        versions = g.get('data_versions') or {}
+        if 'questions' not in versions:
+            versions = data_versions(['questions'])
+        return versions['questions'][0]
+
+    def _load(self, version):
+        cells = Counter()
+        statement = select([Question.category, Question.difficulty, func.count()]) \
+            .group_by(Question.category, Question.difficulty)
+        for category, difficulty, count in db.session.execute(statement):
+            cells[(category, difficulty)] = count
+        with self._lock:
+            self._cells = cells
+            self.version = version
+            self.loads += 1
+
+    def cells(self):
+        version = self._current_version()
+        if version != self.version:
+            self._load(version)
+        return self._cells
+
+    def total(self, category=None):
+        return sum(count for (cell_category, difficulty), count in self.cells().items()
+                   if category is None or cell_category == category)
+
+    def summary(self):
+        categories = Counter()
+        difficulties = Counter()
+        grid = {}
+        for (category, difficulty), count in self.cells().items():
+            if not count:
+                continue
+            difficulties[str(difficulty)] += count
+            if category is not None:
+                categories[str(category)] += count
+                grid.setdefault(str(category), {})[str(difficulty)] = count
+        return {
+            'total_questions': sum(difficulties.values()),
+            'categories': dict(categories),
+            'difficulties': dict(difficulties),
+            'categories_by_difficulty': grid
+        }
+
+    def question_listener(self, action, questions, previous):
+        if self.version is None:
+            return
+        version = data_versions(['questions'])['questions'][0]
+        with self._lock:
+            if action == 'import' or version != self.version + 1:
+                self.version = None
+                return
+            cells = Counter(self._cells)
+            sign = -1 if action == 'delete' else 1
+            for question in questions:
+                cells[(question['category'], question['difficulty'])] += sign
+            for question in previous or ():
+                cells[(question['category'], question['difficulty'])] -= 1
+            self._cells = cells
+            self.version = version
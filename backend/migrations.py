@@ -0,0 +1,111 @@
+import sys
+
+from sqlalchemy import create_engine
+
+from models import db, DATABASE_URL, Question
+from search import create_search_index, SQLITE_FTS_DROP
+
+"""
+Schema migrations
+
+Brings a trivia database created before questions.category became an
+integer foreign key (the model used to declare it as a string) to the
+current schema, keeping its data: missing tables are created, the
+column is converted in place, categories that do not exist become NULL
+and the indexes of the model are created. Running it again is a no-op;
+deployments that run it set DB_CREATE_ALL=false on the app.
+
+    python migrations.py [database_url]
+
+prints the query plans of the hot category queries before and after.
+"""
+HOT_QUERIES = {
+    'category page': "SELECT id FROM questions WHERE category = 1 ORDER BY id LIMIT 10",
+    'category seek': "SELECT id FROM questions WHERE category = 1 AND id >= 10 ORDER BY id LIMIT 1",
+    'category and difficulty': "SELECT id FROM questions WHERE category = 1 AND difficulty = 3",
+}
+
+"""
+query_plan(connection, statement)
+    returns the plan the database picks for statement, as text
+"""
+def query_plan(connection, statement):
+    if connection.dialect.name == 'sqlite':
+        return '\n'.join(row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement))
+    return '\n'.join(row[0] for row in connection.execute('EXPLAIN ' + statement))
+
+
+def _create_indexes(connection):
+    for index in Question.__table__.indexes:
+        connection.execute('CREATE INDEX IF NOT EXISTS {} ON questions ({})'.format(
+            index.name, ', '.join(column.name for column in index.columns)))
+    connection.execute('ANALYZE questions')
+
+
+def _upgrade_postgresql(connection):
+    column_type = connection.execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'questions' AND column_name = 'category'").scalar()
+    if column_type != 'integer':
+        connection.execute(
+            "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+            "USING NULLIF(trim(category), '')::integer")
+
+    has_foreign_key = connection.execute(
+        "SELECT 1 FROM information_schema.table_constraints "
+        "WHERE table_name = 'questions' AND constraint_type = 'FOREIGN KEY'").scalar()
+    if not has_foreign_key:
+        connection.execute(
+            "UPDATE questions SET category = NULL "
+            "WHERE category NOT IN (SELECT id FROM categories)")
+        connection.execute(
+            "ALTER TABLE questions ADD CONSTRAINT questions_category_fkey "
+            "FOREIGN KEY (category) REFERENCES categories (id) "
+            "ON UPDATE CASCADE ON DELETE SET NULL")
+    _create_indexes(connection)
+
+
+def _upgrade_sqlite(connection):
+    # sqlite cannot change a column type, so the table is rebuilt
+    columns = {row[1]: row[2] for row in connection.execute('PRAGMA table_info(questions)')}
+    has_foreign_key = connection.execute('PRAGMA foreign_key_list(questions)').fetchall()
+    if columns['category'].upper() != 'INTEGER' or not has_foreign_key:
+        for statement in SQLITE_FTS_DROP:
+            connection.execute(statement)
+        for index in Question.__table__.indexes:
+            connection.execute('DROP INDEX IF EXISTS {}'.format(index.name))
+        connection.execute('ALTER TABLE questions RENAME TO questions_old')
+        Question.__table__.create(connection)
+        connection.execute(
+            "INSERT INTO questions (id, question, answer, category, difficulty) "
+            "SELECT id, question, answer, "
+            "CASE WHEN CAST(NULLIF(trim(category), '') AS INTEGER) IN (SELECT id FROM categories) "
+            "THEN CAST(NULLIF(trim(category), '') AS INTEGER) END, difficulty "
+            "FROM questions_old")
+        connection.execute('DROP TABLE questions_old')
+    _create_indexes(connection)
+
+"""
+upgrade(engine)
+    migrates the questions table of the database behind engine
+"""
+def upgrade(engine):
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite':
+            _upgrade_sqlite(connection)
+        else:
+            _upgrade_postgresql(connection)
+    create_search_index(engine)
+
+
+if __name__ == '__main__':
+    engine = create_engine(sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL)
+    with engine.connect() as connection:
+        before = {name: query_plan(connection, query) for name, query in HOT_QUERIES.items()}
+    upgrade(engine)
+    with engine.connect() as connection:
+        for name, query in HOT_QUERIES.items():
+            print('{}\n  before: {}\n  after:  {}'.format(
+                name, before[name].replace('\n', '\n          '),
+                query_plan(connection, query).replace('\n', '\n          ')))
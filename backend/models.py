@@ -1,6 +1,17 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import random
+import threading
+import time
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import (BigInteger, Boolean, Column, String, Integer, DateTime, ForeignKey, Index, and_, bindparam, cast,
+                        create_engine, event, func, inspect, select, union_all)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
 from dotenv import load_dotenv
 
 # reference : https://www.geeksforgeeks.org/connecting-to-sql-database-using-sqlalchemy-in-python/
@@ -13,23 +24,243 @@ DB_PASSWORD = os.environ.get("DB_PASSWORD")
 
 DB_PORT = os.environ.get("DB_PORT")
 
+# number of random seeks random_question tries before it walks the id index
+RANDOM_ATTEMPTS = 8
+# the random points of random_seeks are integers below SEEK_SCALE, so that
+# the id they select is computed with integer division, which floors the
+# same on every database, where casting a fraction rounds on postgresql
+SEEK_SCALE = 1 << 30
+
 database_name = 'trivia'
 # database_path = 'postgresql://{}/{}'.format('localhost:5432', database_name)
 database_path="postgresql://{0}:{1}@{2}:{3}/{4}".format(
             DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
         )
-db = SQLAlchemy()
+DATABASE_URL = os.environ.get("DATABASE_URL", database_path)
+
+"""
+ReplicaSet(urls, retry_after=30)
+    engines of the read replicas, handed out in turn. A replica that
+    cannot be connected to is skipped for retry_after seconds; when none
+    is available, reads go to the primary
+"""
+class ReplicaSet(object):
+
+    def __init__(self, urls, retry_after=30):
+        self.engines = [create_engine(url, **engine_options(url)) for url in urls]
+        self.retry_after = retry_after
+        self.down_until = [0.0] * len(self.engines)
+        self.fallbacks = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def choose(self):
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.engines)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            if self.down_until[index] > time.monotonic():
+                continue
+            try:
+                # a pooled connection goes straight back to the pool
+                self.engines[index].connect().close()
+            except DBAPIError:
+                self.down_until[index] = time.monotonic() + self.retry_after
+                continue
+            return self.engines[index]
+        self.fallbacks += 1
+        return None
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+"""
+use_replica()
+    lets the sessions of the current request read from a replica, until
+    they write; GET requests are routed this way by flaskr
+"""
+def use_replica():
+    g.read_replica = True
+
+"""
+primary_written()
+    tells whether the current request committed writes to the primary,
+    whose next reads should not go to a lagging replica
+"""
+def primary_written():
+    return g.get('primary_written', False)
+
+"""
+mark_written()
+    tells the session of db it wrote: Core statements run on
+    db.session.connection() skip its get_bind, and its commit must still
+    send the next reads of the client to the primary
+"""
+def mark_written():
+    db.session().wrote = True
+
+"""
+RoutingSession
+    the session of db: in requests marked with use_replica() it reads
+    from one of the app's replicas until its first write, from then on
+    everything runs on the primary. Sessions given an explicit bind are
+    never routed
+"""
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        self.routed = options.get('bind') is None
+        self.replica = None
+        self.wrote = False
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.wrote = True
+        elif (self.routed and not self.wrote and has_request_context() and g.get('read_replica')
+              and self.app.extensions.get('replicas')):
+            if self.replica is None:
+                self.replica = self.app.extensions['replicas'].choose() or False
+            if self.replica:
+                return self.replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _primary_written(session):
+    if session.wrote and has_request_context():
+        g.primary_written = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
+
+"""
+TimedQueuePool
+    a QueuePool that also records how long checkouts wait for a connection;
+    checkouts run on many threads, so the counters are updated and read
+    together under a lock
+"""
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._timing_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._timing_lock:
+                self.checkouts += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+    def timings(self):
+        with self._timing_lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time
+            }
+
+"""
+engine_options(uri)
+    pool and engine settings for a database URI, from the environment:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds to wait for a
+    connection), DB_POOL_RECYCLE (seconds before a connection is replaced),
+    DB_POOL_PRE_PING and, on postgresql, DB_STATEMENT_TIMEOUT (ms)
+"""
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+        return {}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+    if uri.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000)))
+        }
+    return options
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service; the database is
+    database_path, else the app's SQLALCHEMY_DATABASE_URI, else DATABASE_URL.
+    DB_ENGINE_OPTIONS in the app config override engine_options(), and
+    tables are only created when DB_CREATE_ALL is true (the default).
+    DB_REPLICA_URLS, a list or a comma separated string, adds read
+    replicas, see RoutingSession
 """
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    uri = database_path or app.config.get("SQLALCHEMY_DATABASE_URI") or DATABASE_URL
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(engine_options(uri), **app.config.get("DB_ENGINE_OPTIONS", {}))
     db.app = app
     db.init_app(app)
-    db.create_all()
+    replicas = app.config.get("DB_REPLICA_URLS", os.environ.get("DB_REPLICA_URLS", ""))
+    if isinstance(replicas, str):
+        replicas = [url.strip() for url in replicas.split(',') if url.strip()]
+    category_registry.refresh = int(app.config.get("CATEGORY_REFRESH", os.environ.get("CATEGORY_REFRESH", 5)))
+    if replicas:
+        app.extensions['replicas'] = ReplicaSet(
+            replicas, int(app.config.get("DB_REPLICA_RETRY", os.environ.get("DB_REPLICA_RETRY", 30))))
+    if app.config.get("DB_CREATE_ALL", os.environ.get("DB_CREATE_ALL", "true").lower() == "true"):
+        db.create_all()
+
+"""
+pool_stats(engine)
+    reports the connections of the engine's pool: size, checked in and out,
+    overflow in use and, for a TimedQueuePool, the time spent waiting
+"""
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.timings())
+    return stats
+
+"""
+register_question_listener(app, listener)
+    makes Question.insert, update and delete call
+    listener(action, questions, previous) once their commit went through;
+    action is 'insert', 'update' or 'delete', questions the formatted
+    rows and previous, for updates only, the rows as they were before.
+    Bulk imports call listener('import', None, None): any question may
+    have changed
+"""
+def register_question_listener(app, listener):
+    app.extensions.setdefault('question_listeners', []).append(listener)
+
+def notify_question_listeners(action, questions, previous=None):
+    for listener in current_app.extensions.get('question_listeners', []):
+        listener(action, questions, previous)
 
 """
 Question
@@ -37,11 +268,17 @@ Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    # (category, id) serves category filters, keyset pages and random seeks
+    # within a category; (category, difficulty) serves difficulty draws
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -53,13 +290,21 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_question_listeners('insert', [self.format()])
 
     def update(self):
+        previous = self.format()
+        for attr in inspect(self).attrs:
+            if attr.history.deleted:
+                previous[attr.key] = attr.history.deleted[0]
         db.session.commit()
+        notify_question_listeners('update', [self.format()], [previous])
 
     def delete(self):
+        question = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_question_listeners('delete', [question])
 
     def format(self):
         return {
@@ -70,6 +315,195 @@ class Question(db.Model):
             'difficulty': self.difficulty
         }
 
+"""
+Read path
+
+List endpoints and quiz draws select the question columns with
+SQLAlchemy Core and wrap each row in a QuestionRow, skipping ORM
+hydration, the identity map and change tracking. criteria are column
+expressions such as Question.category == 1.
+"""
+QUESTION_COLUMNS = [Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty]
+
+class QuestionRow(object):
+    __slots__ = ('id', 'question', 'answer', 'category', 'difficulty')
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    def format(self):
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category': self.category,
+            'difficulty': self.difficulty
+        }
+
+
+def _where(statement, criteria):
+    for criterion in criteria:
+        statement = statement.where(criterion)
+    return statement
+
+"""
+questions_statement(criteria=(), offset=0, limit=None)
+    the SELECT of select_questions, also run by the async data layer
+"""
+def questions_statement(criteria=(), offset=0, limit=None):
+    statement = _where(select(QUESTION_COLUMNS), criteria).order_by(Question.id)
+    if offset:
+        statement = statement.offset(offset)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+"""
+select_questions(criteria=(), offset=0, limit=None)
+    returns the matching questions as QuestionRows, ordered by id
+"""
+def select_questions(criteria=(), offset=0, limit=None):
+    return [QuestionRow(*row) for row in db.session.execute(questions_statement(criteria, offset, limit))]
+
+"""
+count_statement(criteria=())
+    the SELECT of count_questions
+"""
+def count_statement(criteria=()):
+    return _where(select([func.count()]).select_from(Question.__table__), criteria)
+
+"""
+count_questions(criteria=())
+    returns how many questions match
+"""
+def count_questions(criteria=()):
+    return db.session.execute(count_statement(criteria)).scalar()
+
+"""
+get_question_row(question_id)
+    returns one question as a QuestionRow, or None
+"""
+def get_question_row(question_id):
+    rows = select_questions([Question.id == question_id], limit=1)
+    return rows[0] if rows else None
+
+"""
+id_range_statement(criteria)
+    the SELECT of the lowest and highest matching ids, from which the
+    random draws pick their points, also run by the async data layer
+"""
+def id_range_statement(criteria):
+    # separate MIN and MAX subqueries: sqlite only reads the ends of the
+    # index for a lone min() or max(), and scans it for both together
+    low = _where(select([func.min(Question.id)]), criteria).as_scalar()
+    high = _where(select([func.max(Question.id)]), criteria).as_scalar()
+    return select([low.label('low'), high.label('high')])
+
+"""
+random_question(category=None, exclude=())
+    picks a random question by seeking the first id at or above a random
+    point of the indexed id range, so the cost does not grow with the
+    number of questions; ids in exclude are skipped by seeking again and,
+    once the attempts run out, by walking the index from the random point
+"""
+def random_question(category=None, exclude=(), attempts=RANDOM_ATTEMPTS):
+    criteria = []
+    if category is not None:
+        criteria.append(Question.category == category)
+
+    low, high = db.session.execute(id_range_statement(criteria)).first()
+    if low is None:
+        return None
+
+    exclude = set(int(question_id) for question_id in exclude)
+    point = random.randint(low, high)
+    for _ in range(attempts):
+        question = select_questions(criteria + [Question.id >= point], limit=1)[0]
+        if question.id not in exclude:
+            return question
+        point = random.randint(low, high)
+
+    criteria.append(Question.id.notin_(exclude))
+    questions = (select_questions(criteria + [Question.id >= point], limit=1)
+                 or select_questions(criteria + [Question.id < point], limit=1))
+    return questions[0] if questions else None
+
+"""
+random_questions(count, category=None, exclude=())
+    picks up to count distinct random questions, in random order, with one
+    query: a UNION ALL of 2 * count index seeks like random_question's,
+    from random points of the id range read in a CTE, each skipping the
+    ids in exclude. When too few seeks land on distinct questions, as in
+    small categories, a second query takes the rest in id order
+"""
+def random_questions(count, category=None, exclude=()):
+    if count < 1:
+        return []
+    exclude = sorted(set(int(question_id) for question_id in exclude))
+    parameters = dict(('point_{}'.format(index), random.randrange(SEEK_SCALE)) for index in range(count * 2))
+    parameters.update(category=category, exclude=exclude)
+    statement = random_seeks(count * 2, category is not None, bool(exclude))
+    connection = db.session.connection().execution_options(compiled_cache=_compiled_seeks)
+
+    questions = {}
+    for row in connection.execute(statement, parameters):
+        if len(questions) < count:
+            questions.setdefault(row[0], QuestionRow(*row))
+    if len(questions) < count:
+        criteria = [Question.id.notin_(exclude + list(questions))] if exclude or questions else []
+        if category is not None:
+            criteria.append(Question.category == category)
+        rest = select_questions(criteria, limit=count - len(questions))
+        questions.update((question.id, question) for question in rest)
+
+    questions = list(questions.values())
+    random.shuffle(questions)
+    return questions
+
+# the statements of random_questions, by shape, are built and compiled
+# once: building a UNION of dozens of selects costs more than running it
+_seek_statements = {}
+_compiled_seeks = {}
+
+"""
+random_seeks(seeks, by_category, excluding)
+    the UNION ALL of random_questions, with the bind parameters point_0
+    to point_<seeks - 1> (integers below SEEK_SCALE, each the fraction of
+    the id range from its lowest to its highest id included), category if
+    by_category and the expanding exclude if excluding
+"""
+def random_seeks(seeks, by_category, excluding):
+    key = (seeks, by_category, excluding)
+    if key not in _seek_statements:
+        criteria = [Question.category == bindparam('category')] if by_category else []
+        bounds = id_range_statement(criteria).cte('bounds')
+        if excluding:
+            criteria.append(Question.id.notin_(bindparam('exclude', expanding=True)))
+        selects = []
+        for index in range(seeks):
+            fraction = bindparam('point_{}'.format(index), type_=BigInteger)
+            span = cast(bounds.c.high - bounds.c.low + 1, BigInteger)
+            point = select([bounds.c.low + span * fraction / SEEK_SCALE])
+            seek = _where(select(QUESTION_COLUMNS), criteria + [Question.id >= point.as_scalar()])
+            selects.append(select([seek.order_by(Question.id).limit(1).alias()]))
+        _seek_statements[key] = union_all(*selects)
+    return _seek_statements[key]
+
+"""
+question_ids(category=None)
+    returns the ids of all questions, or of one category, without loading rows
+"""
+def question_ids(category=None):
+    statement = select([Question.id])
+    if category is not None:
+        statement = statement.where(Question.category == category)
+    return [question_id for question_id, in db.session.execute(statement)]
+
 """
 Category
 
@@ -88,3 +522,239 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
             }
+
+"""
+CategoryRegistry(refresh=5)
+    serves the id -> type dict of categories from memory; it loads the
+    table once and again after a category write through this process has
+    bumped the version stamp, or when the categories data version, read
+    at most every refresh seconds, shows a write from another worker.
+    Counts hits and misses
+"""
+class CategoryRegistry(object):
+
+    def __init__(self, refresh=5):
+        self.refresh = refresh
+        self.version = 0
+        self.checked = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def all(self):
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == self.version and self._current(loaded[1]):
+            self.hits += 1
+            return loaded[2]
+
+        with self._lock:
+            version = self.version
+            # read before the table, so a write in between shows at the next check
+            data_version = self._data_version()
+            categories = {}
+            for category in Category.query.order_by(Category.id):
+                categories[str(category.id)] = category.type
+            self._loaded = (version, data_version, categories)
+            self.checked = time.monotonic()
+            self.misses += 1
+        return categories
+
+    def _data_version(self):
+        # @conditional views already read the versions of this request
+        versions = g.get('data_versions') or {}
+        if 'categories' not in versions:
+            versions = data_versions(['categories'])
+        return versions['categories'][0]
+
+    def _current(self, data_version):
+        if time.monotonic() - self.checked < self.refresh:
+            return True
+        if self._data_version() != data_version:
+            return False
+        self.checked = time.monotonic()
+        return True
+
+    def get(self, category_id):
+        return self.all().get(str(category_id))
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+category_registry = CategoryRegistry()
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _category_written(mapper, connection, target):
+    inspect(target).session.info['categories_written'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_categories(session):
+    if session.info.pop('categories_written', False):
+        category_registry.invalidate()
+
+"""
+QuizSession
+    a quiz played in session mode, used when sessions are shared between
+    workers through the database: position is the number of questions
+    handed out, the shuffled order is in QuizSessionQuestion
+"""
+class QuizSession(db.Model):
+    __tablename__ = 'quiz_sessions'
+
+    id = Column(String(32), primary_key=True)
+    position = Column(Integer, default=0, nullable=False)
+    expires_at = Column(DateTime, index=True)
+
+"""
+QuizSessionQuestion
+    the question at one position of a session's shuffled order, so that
+    the next one is a primary key lookup whatever the length of the quiz
+"""
+class QuizSessionQuestion(db.Model):
+    __tablename__ = 'quiz_session_questions'
+
+    session_id = Column(String(32), ForeignKey('quiz_sessions.id', ondelete='CASCADE'), primary_key=True)
+    position = Column(Integer, primary_key=True, autoincrement=False)
+    question_id = Column(Integer, nullable=False)
+
+"""
+DataVersion
+    a counter per dataset ('questions', 'categories') bumped in the same
+    transaction as every write to it, with the time of that write; it
+    drives the ETag and Last-Modified headers of the read endpoints
+"""
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+
+    name = Column(String(32), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+"""
+bump_data_version(connection, name)
+    increments the version of a dataset through connection and returns it.
+    The row stays locked until the transaction ends, so the writes of a
+    dataset get their versions in commit order
+"""
+def bump_data_version(connection, name):
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    update = table.update().where(table.c.name == name).values(version=table.c.version + 1, updated_at=now)
+    if connection.dialect.name == 'postgresql':
+        version = connection.execute(update.returning(table.c.version)).scalar()
+    elif connection.execute(update).rowcount:
+        version = connection.execute(select([table.c.version]).where(table.c.name == name)).scalar()
+    else:
+        version = None
+    if version is None:
+        connection.execute(table.insert().values(name=name, version=1, updated_at=now))
+        version = 1
+    return version
+
+"""
+data_versions(names)
+    returns {name: (version, updated_at)} in one primary key lookup;
+    datasets never written have version 0 and no updated_at
+"""
+def data_versions(names):
+    versions = dict((name, (0, None)) for name in names)
+    for name, version, updated_at in db.session.execute(data_versions_statement(names)):
+        versions[name] = (version, updated_at)
+    return versions
+
+def data_versions_statement(names):
+    table = DataVersion.__table__
+    return select([table.c.name, table.c.version, table.c.updated_at]).where(table.c.name.in_(names))
+
+"""
+QuestionChange
+    the change log of questions: one row per question written, tagged
+    with the questions version of its transaction, deleted for the
+    tombstones of deleted questions. Question.insert, update and delete
+    write it through the session's flush, the bulk functions of bulk.py
+    with log_question_changes
+"""
+class QuestionChange(db.Model):
+    __tablename__ = 'question_changes'
+    __table_args__ = (
+        Index('ix_question_changes_question_id', 'question_id', 'version'),
+    )
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    question_id = Column(Integer, primary_key=True, autoincrement=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+    changed_at = Column(DateTime, nullable=False)
+
+"""
+log_question_changes(connection, version, ids=(), deleted=False, after_id=None)
+    records that the questions of ids, and with after_id every question
+    with a greater id, were written (or deleted) at version
+"""
+def log_question_changes(connection, version, ids=(), deleted=False, after_id=None):
+    table = QuestionChange.__table__
+    now = datetime.utcnow()
+    if ids:
+        connection.execute(table.insert(), [
+            {'version': version, 'question_id': question_id, 'deleted': deleted, 'changed_at': now}
+            for question_id in ids])
+    if after_id is not None:
+        rows = select([bindparam('version', version, type_=Integer), Question.id,
+                       bindparam('deleted', deleted, type_=Boolean), bindparam('changed_at', now, type_=DateTime)])
+        connection.execute(table.insert().from_select(
+            ['version', 'question_id', 'deleted', 'changed_at'], rows.where(Question.id > after_id)))
+
+"""
+compact_question_changes(connection, before)
+    drops the changes a later change of the same question supersedes,
+    then the tombstones older than before. Clients that synced before
+    the newest dropped tombstone can no longer catch up from the log:
+    its version is kept as the 'question_changes' data version, the
+    floor below which /questions/changes answers 410. Returns how many
+    changes were dropped
+"""
+def compact_question_changes(connection, before):
+    table = QuestionChange.__table__
+    later = table.alias('later')
+    newest = select([func.max(later.c.version)]).where(later.c.question_id == table.c.question_id).as_scalar()
+    dropped = connection.execute(table.delete().where(table.c.version < newest)).rowcount
+
+    expired = and_(table.c.deleted.is_(True), table.c.changed_at < before)
+    floor = connection.execute(select([func.max(table.c.version)]).where(expired)).scalar()
+    if floor is not None:
+        dropped += connection.execute(table.delete().where(expired)).rowcount
+        versions = DataVersion.__table__
+        named = versions.c.name == 'question_changes'
+        current = connection.execute(select([versions.c.version]).where(named)).scalar()
+        if current is None:
+            connection.execute(versions.insert().values(name='question_changes', version=floor,
+                                                        updated_at=datetime.utcnow()))
+        elif current < floor:
+            connection.execute(versions.update().where(named).values(version=floor, updated_at=datetime.utcnow()))
+    return dropped
+
+@event.listens_for(Session, 'after_flush')
+def _bump_data_versions(session, flush_context):
+    names = set()
+    written = set()
+    deleted = set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, Question):
+            names.add('questions')
+            (deleted if instance in session.deleted else written).add(instance.id)
+        elif isinstance(instance, Category):
+            names.add('categories')
+    for name in sorted(names):
+        version = bump_data_version(session.connection(), name)
+        if name == 'questions':
+            log_question_changes(session.connection(), version, sorted(written))
+            log_question_changes(session.connection(), version, sorted(deleted), deleted=True)
@@ -0,0 +1,140 @@
+import logging
+
+from sqlalchemy import column, func, literal_column, select, table
+from sqlalchemy.exc import DBAPIError
+
+from models import db, Question, QuestionRow, QUESTION_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# terms shorter than a trigram cannot use the indexes below
+MIN_INDEXED_LENGTH = 3
+
+questions_fts = table('questions_fts', column('rowid'), column('question'))
+
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE questions_fts USING fts5(
+        question, content='questions', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER questions_fts_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+    END""",
+    """CREATE TRIGGER questions_fts_delete AFTER DELETE ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, question) VALUES ('delete', old.id, old.question);
+    END""",
+    """CREATE TRIGGER questions_fts_update AFTER UPDATE OF question ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, question) VALUES ('delete', old.id, old.question);
+        INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+    END""",
+    "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')",
+]
+
+SQLITE_FTS_DROP = [
+    "DROP TRIGGER IF EXISTS questions_fts_insert",
+    "DROP TRIGGER IF EXISTS questions_fts_delete",
+    "DROP TRIGGER IF EXISTS questions_fts_update",
+    "DROP TABLE IF EXISTS questions_fts",
+]
+
+POSTGRES_TRIGRAM = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions USING gin (question gin_trgm_ops)",
+]
+
+"""
+create_search_index(engine)
+    creates the search index of a database if it is missing and returns
+    the search backend to use: 'trigram' for a pg_trgm GIN index on
+    postgresql, which serves ILIKE '%term%', 'fts5' for an FTS5 trigram
+    table kept in sync by triggers on sqlite, or 'ilike' without index
+"""
+def create_search_index(engine):
+    try:
+        if engine.dialect.name == 'postgresql':
+            with engine.begin() as connection:
+                for statement in POSTGRES_TRIGRAM:
+                    connection.execute(statement)
+            return 'trigram'
+        if engine.dialect.name == 'sqlite':
+            with engine.begin() as connection:
+                exists = connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'").scalar()
+                if not exists:
+                    for statement in SQLITE_FTS:
+                        connection.execute(statement)
+            return 'fts5'
+    except DBAPIError:
+        logger.warning('No search index available, falling back to ILIKE', exc_info=True)
+    return 'ilike'
+
+"""
+setup_search(app)
+    prepares the search index of the app's database
+"""
+def setup_search(app):
+    app.config['SEARCH_BACKEND'] = create_search_index(db.get_engine(app))
+
+"""
+suspend_search_index(connection)
+    drops the trigger indexing each inserted question in the sqlite FTS5
+    table, before a bulk load; returns whether there was one to drop
+"""
+def suspend_search_index(connection):
+    if connection.dialect.name != 'sqlite' or not connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'questions_fts_insert'").scalar():
+        return False
+    connection.execute("DROP TRIGGER questions_fts_insert")
+    return True
+
+"""
+resume_search_index(connection)
+    recreates the trigger after a bulk load and rebuilds the FTS5 table,
+    which is an order of magnitude faster than indexing row by row
+"""
+def resume_search_index(connection):
+    connection.execute(SQLITE_FTS[1])
+    connection.execute(SQLITE_FTS[-1])
+
+
+"""
+_escape_like(term)
+    escapes the LIKE wildcards in term so that it only matches itself
+"""
+def _escape_like(term):
+    return term.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+def _matches(term, backend):
+    if backend == 'fts5' and len(term) >= MIN_INDEXED_LENGTH:
+        # a quoted fts5 phrase of trigrams is a case insensitive substring match
+        phrase = '"{}"'.format(term.replace('"', '""'))
+        score = -func.bm25(literal_column('questions_fts'))
+        statement = select(QUESTION_COLUMNS + [score.label('score')]) \
+            .select_from(Question.__table__.join(questions_fts, questions_fts.c.rowid == Question.id)) \
+            .where(literal_column('questions_fts').op('MATCH')(phrase))
+        return statement, score
+
+    if backend == 'trigram' and len(term) >= MIN_INDEXED_LENGTH:
+        score = func.word_similarity(term, Question.question)
+    else:
+        score = literal_column('0.0')
+    statement = select(QUESTION_COLUMNS + [score.label('score')]) \
+        .where(Question.question.ilike('%{}%'.format(_escape_like(term)), escape='/'))
+    return statement, score
+
+"""
+search_questions(term, offset, limit, backend)
+    returns one page of (question row, score) pairs whose question
+    contains term, most relevant first
+"""
+def search_questions(term, offset, limit, backend):
+    statement, score = _matches(term, backend)
+    statement = statement.order_by(score.desc(), Question.id).offset(offset).limit(limit)
+    return [(QuestionRow(*row[:-1]), row[-1]) for row in db.session.execute(statement)]
+
+"""
+count_search_results(term, backend)
+    returns how many questions contain term
+"""
+def count_search_results(term, backend):
+    statement, score = _matches(term, backend)
+    statement = select([func.count()]).select_from(statement.alias())
+    return db.session.execute(statement).scalar()
@@ -1,10 +1,75 @@
+import asyncio
+import gzip
 import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 import json
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event, func, inspect
+from sqlalchemy.pool import StaticPool
+from werkzeug.http import http_date
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr import responses
+from flaskr.quiz_sessions import DatabaseSessionStore
+from flaskr.responses import compress, jsonify
+from models import (db, bump_data_version, category_registry, compact_question_changes, engine_options, pool_stats,
+                    random_question, DataVersion, Question, QuizSessionQuestion, Category, TimedQueuePool)
+from migrations import upgrade, query_plan, HOT_QUERIES
+
+try:
+    import aiosqlite
+    from flaskr.asgi import create_asgi_app
+except ImportError:
+    aiosqlite = None
+
+TRIVIA_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')
+
+# every app of the suite shares one in-memory SQLite connection, so the
+# schema and the trivia data are created once per run; in autocommit mode
+# pysqlite leaves BEGIN and SAVEPOINT to SQLAlchemy, see begin_transaction
+connection = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+TEST_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    'DB_ENGINE_OPTIONS': {'creator': lambda: connection, 'poolclass': StaticPool},
+}
+
+
+def begin_transaction(connection):
+    connection.execute('BEGIN')
+
+
+def restart_savepoint(session, transaction):
+    # the view committed or rolled back the test's savepoint, open the next one
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
+
+
+def load_trivia_data(connection):
+    """Insert the categories and questions of trivia.psql"""
+    with open(TRIVIA_DATA) as dump:
+        text = dump.read()
+    for table in (Category.__table__, Question.__table__):
+        match = re.search(r'COPY public\.{} \((.*?)\) FROM stdin;\n(.*?)\\\.'.format(table.name), text, re.S)
+        columns = match.group(1).split(', ')
+        connection.execute(table.insert(), [dict(zip(columns, line.split('\t')))
+                                            for line in match.group(2).splitlines()])
+
+
+def setUpModule():
+    """Create the schema and load the trivia data once."""
+    app = create_app(TEST_CONFIG)
+    with app.app_context():
+        with db.get_engine(app).begin() as connection:
+            load_trivia_data(connection)
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -12,30 +77,36 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = create_app(TEST_CONFIG)
         self.client = self.app.test_client
-        self.user = 'postgres'
-        self.password = 'postgres'
-        self.host = '127.0.0.1'
-        self.port = 5432
-        self.database_name = 'trivia_test'
-        self.database_path = "postgresql://{0}:{1}@{2}:{3}/{4}".format(
-            self.user, self.password, self.host, self.port, self.database_name
-        )
-        setup_db(self.app, self.database_path)
 
         self.new_question = {"question": "Quel est ton nom ?", "answer": "Mon nom est Gregory Goufan", "category": 3, "difficulty": 5}
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+        # binds the app to the current context and runs the test in a
+        # transaction, its commits releasing SAVEPOINTs inside of it
+        self.context = self.app.app_context()
+        self.context.push()
+        engine = db.get_engine(self.app)
+        if not event.contains(engine, 'begin', begin_transaction):
+            event.listen(engine, 'begin', begin_transaction)
+        self.connection = engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        db.session = db.create_scoped_session({'bind': self.connection, 'binds': {}})
+        db.session.begin_nested()
+        event.listen(db.session(), 'after_transaction_end', restart_savepoint)
     
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        event.remove(db.session(), 'after_transaction_end', restart_savepoint)
+        db.session.rollback()
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
+        self.context.pop()
+        # categories written by the test were rolled back
+        category_registry.invalidate()
 
     """
     @DONE
@@ -48,6 +119,38 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data["categories"])
+    def test_categories_from_registry(self):
+        category_registry.invalidate()
+        stats = category_registry.stats()
+        self.client().get("/categories")
+        self.client().get("/categories")
+
+        self.assertEqual(category_registry.stats()["misses"], stats["misses"] + 1)
+        self.assertEqual(category_registry.stats()["hits"], stats["hits"] + 1)
+
+        # a write through this process reloads at once
+        db.session.add(Category("Music"))
+        db.session.commit()
+        data = json.loads(self.client().get("/categories").data)
+        self.assertIn("Music", data["categories"].values())
+
+    def test_categories_written_by_another_worker(self):
+        self.client().get("/categories")
+        # as another worker would: no ORM event here, only the data version
+        connection = db.session.connection()
+        connection.execute(Category.__table__.insert().values(id=100, type="Music"))
+        bump_data_version(connection, "categories")
+        db.session.commit()
+
+        refresh = category_registry.refresh
+        try:
+            category_registry.refresh = 3600
+            self.assertNotIn("100", category_registry.all())
+            category_registry.refresh = 0
+            data = json.loads(self.client().get("/categories").data)
+            self.assertEqual(data["categories"]["100"], "Music")
+        finally:
+            category_registry.refresh = refresh
     # Fail
     def test_405_if_categories_(self):
         res = self.client().delete("/categories")
@@ -69,11 +172,70 @@ class TriviaTestCase(unittest.TestCase):
 
         res = self.client().get("/questions?page=1")
         data = json.loads(res.data)
+    def test_304_if_questions_not_modified(self):
+        res = self.client().get("/questions?page=1")
+        etag = res.headers["ETag"]
+
+        res = self.client().get("/questions?page=1", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+
+        # a cache revalidating its gzip copy gets that copy's tag back
+        res = self.client().get("/questions?page=1", headers={"Accept-Encoding": "gzip"})
+        gzip_etag = res.headers["ETag"]
+        self.assertTrue(gzip_etag.endswith('-gzip"'))
+        res = self.client().get("/questions?page=1", headers={"Accept-Encoding": "gzip",
+                                                              "If-None-Match": "{}, {}".format(etag, gzip_etag)})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], gzip_etag)
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+
+        self.client().post("/questions", json=self.new_question)
+        res = self.client().get("/questions?page=1", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+    def test_304_if_questions_not_modified_since(self):
+        self.client().post("/questions", json=self.new_question)
+        written_at = datetime(2024, 1, 1, 12, 0, 0)
+        versions = DataVersion.__table__
+        db.session.execute(versions.update().where(versions.c.name == "questions").values(updated_at=written_at))
+        db.session.commit()
+
+        res = self.client().get("/questions?page=1", headers={"If-Modified-Since": http_date(written_at)})
+        self.assertEqual(res.status_code, 304)
+
+        # a second write within the same second keeps the same Last-Modified
+        later = written_at + timedelta(milliseconds=500)
+        db.session.execute(versions.update().where(versions.c.name == "questions").values(updated_at=later))
+        db.session.commit()
+        res = self.client().get("/questions?page=1", headers={"If-Modified-Since": http_date(written_at)})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Last-Modified"], http_date(written_at))
+
+    # GET '/questions?after_id=${integer}'
+    def test_get_questions_after_id(self):
+        expected = [question.id for question in Question.query.filter(Question.id > 10).order_by(Question.id).limit(10)]
+        res = self.client().get("/questions?after_id=10")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(expected), 10)
+        self.assertEqual([question["id"] for question in data["questions"]], expected)
+
     # Fail
     def test_422_get_paginated_questions(self):
         res = self.client().get("/questions?page=1000")
         data = json.loads(res.data)
 
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "unprocessable")
+    def test_422_get_questions_after_last_id(self):
+        last_id = db.session.query(func.max(Question.id)).scalar()
+        res = self.client().get("/questions?after_id={}".format(last_id))
+        data = json.loads(res.data)
+
         self.assertEqual(res.status_code, 422)
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "unprocessable")
@@ -95,6 +257,37 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Not found")
 
+    # GET '/questions?page=${integer}' and '/categories/${id}/questions' from the response cache
+    def test_cached_pages_invalidated_by_category(self):
+        cache = self.app.extensions["response_cache"]
+        total = json.loads(self.client().get("/questions?page=1").data)["total_questions"]
+        history = self.client().get("/categories/4/questions").data
+        res = self.client().get("/questions?page=1", headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertTrue(res.headers["ETag"].endswith('-gzip"'))
+        self.assertEqual(json.loads(gzip.decompress(res.data))["total_questions"], total)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+        # a question of category 3 empties /questions, not the pages of category 4
+        self.client().post("/questions", json=self.new_question)
+        self.assertEqual(self.client().get("/categories/4/questions").data, history)
+        self.assertEqual(cache.stats()["hits"], 2)
+        data = json.loads(self.client().get("/questions?page=1").data)
+        self.assertEqual(data["total_questions"], total + 1)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    # Fail
+    def test_422_page_beyond_last_not_cached(self):
+        cache = self.app.extensions["response_cache"]
+        for _ in range(2):
+            res = self.client().get("/questions?page=1000")
+            self.assertEqual(res.status_code, 422)
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["misses"], 2)
+
     # POST '/questions'
     def test_create_new_question(self):
         res = self.client().post("/questions", json=self.new_question)
@@ -111,6 +304,14 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
         self.assertTrue(data["total_questions"])
+    def test_search_results_are_ranked(self):
+        res = self.client().post("/questions", json={"searchTerm": "title"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        scores = [question["score"] for question in data["questions"]]
+        self.assertTrue(scores)
+        self.assertEqual(scores, sorted(scores, reverse=True))
     # Fail
     def test_422_search_question_by_search_term(self):
         res = self.client().get("/questions?page=200", json={"searchTerm": None})
@@ -121,9 +322,182 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "unprocessable")
 
 
+    # GET '/questions/search?q=${term}'
+    def test_get_search_questions(self):
+        res = self.client().get("/questions/search?q=title")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], len(data["questions"]))
+        self.assertTrue(res.headers["Cache-Control"])
+    def test_get_search_questions_treats_wildcards_literally(self):
+        self.client().post("/questions", json=dict(self.new_question, question="Is 100% of a_b wildcard free?"))
+        for term in ("%", "_"):
+            res = self.client().get("/questions/search?q=" + quote(term))
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([question["question"] for question in data["questions"]], ["Is 100% of a_b wildcard free?"])
+    # Fail
+    def test_422_get_search_questions_without_term(self):
+        res = self.client().get("/questions/search")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    # GET '/questions/autocomplete?q=${text}'
+    def test_autocomplete_questions(self):
+        res = self.client().get("/questions/autocomplete?q=what is the hea")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([suggestion["id"] for suggestion in data["suggestions"]], [20])
+
+        res = self.client().post("/questions", json=dict(self.new_question, question="Heavy metal?"))
+        created = json.loads(res.data)["created"]
+        data = json.loads(self.client().get("/questions/autocomplete?q=hea").data)
+
+        self.assertEqual([suggestion["id"] for suggestion in data["suggestions"]], [created, 20])
+
+    def test_autocomplete_question_without_text(self):
+        self.client().get("/questions/autocomplete?q=hea")
+        res = self.client().post("/questions", json={"answer": "None", "category": 3, "difficulty": 1})
+        self.assertEqual(res.status_code, 200)
+
+        # as a fresh worker, build the index again over the row without text
+        self.app.extensions["autocomplete"].version = None
+        self.assertEqual(self.client().get("/categories").status_code, 200)
+        data = json.loads(self.client().get("/questions/autocomplete?q=hea").data)
+        self.assertEqual([suggestion["id"] for suggestion in data["suggestions"]], [20])
+    # Fail
+    def test_422_autocomplete_questions_limit_too_large(self):
+        res = self.client().get("/questions/autocomplete?q=what&limit=1000")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    # POST '/questions/batch'
+    def test_create_questions_batch(self):
+        total = Question.query.count()
+        res = self.client().post("/questions/batch", json={"questions": [self.new_question] * 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["results"]), 3)
+        self.assertEqual(data["total_questions"], total + 3)
+        for result in data["results"]:
+            self.assertIsNotNone(Question.query.get(result["id"]))
+    # Fail
+    def test_422_create_questions_batch_invalid_item(self):
+        total = Question.query.count()
+        res = self.client().post("/questions/batch", json={"questions": [
+            self.new_question, {"question": "No answer"}, dict(self.new_question, category=300)]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2])
+        self.assertEqual(Question.query.count(), total)
+
+    # DELETE '/questions/batch'
+    def test_delete_questions_batch(self):
+        res = self.client().delete("/questions/batch", json={"ids": [5, 9, 300]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result["deleted"] for result in data["results"]], [True, True, False])
+        self.assertIsNone(Question.query.get(5))
+    # Fail
+    def test_422_delete_questions_batch_invalid_id(self):
+        res = self.client().delete("/questions/batch", json={"ids": [5, "nine"]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["errors"][0]["index"], 1)
+        self.assertIsNotNone(Question.query.get(5))
+
+    # POST '/questions/import'
+    def test_import_questions(self):
+        body = '\n'.join(json.dumps(dict(self.new_question, question=str(index))) for index in range(3))
+        res = self.client().post("/questions/import", data=body, content_type="application/x-ndjson")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["imported"], 3)
+
+        body = "question,answer,category,difficulty\nWho?,Me,1,\n"
+        res = self.client().post("/questions/import", data=body, content_type="text/csv")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["imported"], 1)
+    # Fail
+    def test_422_import_questions_invalid_row(self):
+        total = Question.query.count()
+        body = json.dumps(self.new_question) + '\n{"question": "No answer"}\n'
+        res = self.client().post("/questions/import", data=body, content_type="application/x-ndjson")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["line"], 2)
+        self.assertEqual(Question.query.count(), total)
+
+    # GET '/questions/export?format=${format}'
+    def test_export_questions(self):
+        res = self.client().get("/questions/export?format=csv")
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[0], "id,question,answer,category,difficulty")
+        self.assertEqual(len(lines) - 1, Question.query.count())
+
+        res = self.client().get("/questions/export")
+        questions = [json.loads(line) for line in res.data.splitlines()]
+        self.assertEqual(len(questions), Question.query.count())
+    # Fail
+    def test_422_export_questions_unknown_format(self):
+        res = self.client().get("/questions/export?format=xml")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    # GET '/questions/changes?since=${version}'
+    def test_get_question_changes(self):
+        res = self.client().get("/questions/changes")
+        since = int(res.headers["X-Data-Version"])
+
+        self.assertEqual(len(res.data.splitlines()), Question.query.count())
+
+        created = json.loads(self.client().post("/questions", json=self.new_question).data)["created"]
+        self.client().delete("/questions/5")
+        res = self.client().get("/questions/changes?since={}".format(since))
+        changes = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([(change["id"], change.get("deleted", False)) for change in changes],
+                         [(created, False), (5, True)])
+        self.assertEqual(changes[0]["question"]["answer"], self.new_question["answer"])
+        self.assertEqual(int(res.headers["X-Data-Version"]), changes[-1]["version"])
+    # Fail
+    def test_410_question_changes_compacted(self):
+        since = int(self.client().get("/questions/changes").headers["X-Data-Version"])
+        self.client().delete("/questions/5")
+        self.client().delete("/questions/9")
+        compact_question_changes(db.session.connection(), datetime.utcnow() + timedelta(days=1))
+        db.session.commit()
+
+        res = self.client().get("/questions/changes?since={}".format(since))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 410)
+        self.assertEqual(data["success"], False)
+
     # DELETE '/questions/${id}'
     def test_delete_question(self):
-        res = self.client().delete('/questions/1')
+        res = self.client().delete('/questions/5')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
@@ -136,6 +510,53 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
+    # GET '/stats'
+    def test_get_stats(self):
+        res = self.client().get("/stats")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], Question.query.count())
+        self.assertEqual(data["categories"]["1"], Question.query.filter(Question.category == 1).count())
+        self.assertEqual(sum(data["categories_by_difficulty"]["1"].values()), data["categories"]["1"])
+
+        # writes update the counters in place, without counting again
+        self.client().post("/questions", json=self.new_question)
+        self.client().delete("/questions/5")
+        res = self.client().get("/stats")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["total_questions"], Question.query.count())
+        self.assertEqual(data["categories"]["3"], Question.query.filter(Question.category == 3).count())
+        self.assertEqual(self.app.extensions['question_stats'].loads, 1)
+    # Fail
+    def test_405_post_stats(self):
+        res = self.client().post("/stats")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 405)
+        self.assertEqual(data["success"], False)
+
+    # GET '/bootstrap'
+    def test_get_bootstrap(self):
+        res = self.client().get("/bootstrap")
+        data = json.loads(res.data)
+        questions = json.loads(self.client().get("/questions?page=1").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["questions"], questions["questions"])
+        self.assertEqual(data["categories"], questions["categories"])
+        self.assertEqual(data["total_questions"], questions["total_questions"])
+        self.assertEqual(data["category_counts"]["1"], Question.query.filter(Question.category == 1).count())
+        self.assertEqual(res.headers["ETag"], '"v{questions}.{categories}"'.format(**data["data_versions"]))
+    # Fail
+    def test_405_post_bootstrap(self):
+        res = self.client().post("/bootstrap")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 405)
+        self.assertEqual(data["success"], False)
+
     # POST '/quizzes'
     def test_get_random_question(self):
         res = self.client().post("/quizzes", json={'previous_questions': [],
@@ -145,6 +566,128 @@ class TriviaTestCase(unittest.TestCase):
         
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['question'])
+    def test_random_question_skips_previous_questions(self):
+        for _ in range(10):
+            res = self.client().post("/quizzes", json={'previous_questions': [20, 21],
+                'quiz_category': {'type': "Science", 'id': "1"}
+            })
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['question']['id'], 22)
+    def test_random_question_walks_once_attempts_run_out(self):
+        # every seek lands on an excluded question, so the walk from the
+        # last point has to find the rest, above the point or below it
+        with mock.patch("models.random.randint", return_value=20):
+            self.assertEqual(random_question(1, exclude=[20, 21]).id, 22)
+        with mock.patch("models.random.randint", return_value=22):
+            self.assertEqual(random_question(1, exclude=[22]).id, 20)
+            self.assertEqual(random_question(1, exclude=[20, 22], attempts=0).id, 21)
+    def test_random_question_when_all_questions_are_previous(self):
+        res = self.client().post("/quizzes", json={'previous_questions': [20, 21, 22],
+            'quiz_category': {'type': "Science", 'id': "1"}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question'], None)
+        self.assertEqual(random_question(1, exclude=[20, 21, 22]), None)
+    # POST '/quizzes' prefetch mode
+    def test_prefetch_random_questions(self):
+        res = self.client().post("/quizzes", json={'previous_questions': [20], 'count': 5,
+            'quiz_category': {'type': "Science", 'id': "1"}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(sorted(ids), [21, 22])
+        self.assertEqual(data['question'], data['questions'][0])
+
+    def test_prefetch_draws_every_question_of_category(self):
+        drawn = set()
+        for _ in range(60):
+            res = self.client().post("/quizzes", json={'previous_questions': [], 'count': 1,
+                'quiz_category': {'type': "Science", 'id': "1"}
+            })
+            drawn.update(question['id'] for question in json.loads(res.data)['questions'])
+
+        # the highest id of the category too, not only the lower ones
+        self.assertEqual(drawn, {20, 21, 22})
+    # Fail
+    def test_422_prefetch_too_many_questions(self):
+        res = self.client().post("/quizzes", json={'previous_questions': [], 'count': 1000,
+            'quiz_category': {'type': "Science", 'id': "1"}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    # POST '/quizzes' difficulty modes
+    def test_quiz_questions_by_difficulty(self):
+        res = self.client().post("/quizzes", json={'previous_questions': [], 'difficulty': 2, 'count': 3,
+            'quiz_category': {'type': "click", 'id': 0}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['difficulty'] for question in data['questions']], [2, 2, 2])
+
+        difficulties = []
+        for correct_answers in (0, 1, 2):
+            res = self.client().post("/quizzes", json={'previous_questions': [], 'difficulty': 'adaptive',
+                'correct_answers': correct_answers, 'quiz_category': {'type': "Science", 'id': 1}
+            })
+            difficulties.append(json.loads(res.data)['question']['difficulty'])
+
+        self.assertEqual(difficulties, [3, 4, 4])
+    # Fail
+    def test_422_quiz_unknown_difficulty(self):
+        res = self.client().post("/quizzes", json={'previous_questions': [], 'difficulty': "hard",
+            'quiz_category': {'type': "Science", 'id': 1}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    # POST '/quizzes' session mode
+    def test_quiz_session(self):
+        res = self.client().post("/quizzes", json={'session': True,
+            'quiz_category': {'type': "Science", 'id': "1"}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['question'])
+        self.assertTrue(data['session_id'])
+
+        seen = [data['question']['id']]
+        res = self.client().post("/quizzes", json={'session_id': data['session_id']})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn(data['question']['id'], seen)
+    def test_quiz_session_in_database(self):
+        store = DatabaseSessionStore()
+        session_id = store.create([20, 21, 22])
+        rows = db.session.query(QuizSessionQuestion).filter(QuizSessionQuestion.session_id == session_id).count()
+
+        self.assertEqual(rows, 3)
+        self.assertEqual(sorted(store.pop(session_id) for _ in range(3)), [20, 21, 22])
+        self.assertIsNone(store.pop(session_id))
+        with self.assertRaises(KeyError):
+            store.pop("unknown")
+    # Fail
+    def test_404_unknown_quiz_session(self):
+        res = self.client().post("/quizzes", json={'session_id': "unknown"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
     # Fail
     def test_500_random_question(self):
         res = self.client().post("/quizzes", json={'previous_questions': [],
@@ -157,6 +700,453 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "Server Side Error")
 
 
+    # JSON encoding, JSON_SERIALIZER
+    def test_json_serializer(self):
+        self.app.config["JSON_SERIALIZER"] = "json"
+        res = self.client().get("/categories")
+        payload = json.loads(res.data)
+
+        self.assertEqual(res.data, json.dumps(payload, sort_keys=True, separators=(",", ":")).encode())
+        if responses.orjson is not None:
+            self.app.config["JSON_SERIALIZER"] = "orjson"
+            res = self.client().get("/categories")
+            self.assertEqual(res.data, responses.orjson.dumps(payload, option=responses.orjson.OPT_SORT_KEYS))
+
+    # Accept-Encoding negotiation and COMPRESS_MIN_SIZE
+    def test_compression_negotiation(self):
+        page = self.client().get("/questions?page=1").data
+        self.assertGreaterEqual(len(page), self.app.config["COMPRESS_MIN_SIZE"])
+
+        res = self.client().get("/questions?page=1", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+        self.assertEqual(gzip.decompress(res.data), page)
+
+        res = self.client().get("/questions?page=1", headers={"Accept-Encoding": "br, gzip"})
+        self.assertEqual(res.headers["Content-Encoding"], "br" if responses.brotli is not None else "gzip")
+        if responses.brotli is not None:
+            self.assertEqual(responses.brotli.decompress(res.data), page)
+
+        res = self.client().get("/questions?page=1", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", res.headers)
+        self.assertEqual(res.data, page)
+
+        # below the threshold
+        res = self.client().get("/categories", headers={"Accept-Encoding": "gzip"})
+        self.assertLess(len(res.data), self.app.config["COMPRESS_MIN_SIZE"])
+        self.assertNotIn("Content-Encoding", res.headers)
+
+    # compress() overrides per view
+    def test_compress_overrides(self):
+        @self.app.route("/tiny")
+        @compress(min_size=0, level=0)
+        def tiny():
+            return jsonify({"answer": 42})
+
+        res = self.client().get("/tiny", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        # level 0 stores the body uncompressed inside the gzip framing
+        self.assertIn(b'"answer":42', res.data)
+        self.assertEqual(json.loads(gzip.decompress(res.data)), {"answer": 42})
+    # Fail
+    def test_compress_disabled_for_quizzes(self):
+        self.app.config["COMPRESS_MIN_SIZE"] = 1
+        res = self.client().post("/quizzes", headers={"Accept-Encoding": "gzip"},
+                                 json={"previous_questions": [], "quiz_category": {"type": "click", "id": 0}})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("Content-Encoding", res.headers)
+        self.assertTrue(json.loads(res.data)["question"])
+        self.assertEqual(self.client().get("/categories", headers={"Accept-Encoding": "gzip"})
+                         .headers["Content-Encoding"], "gzip")
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    """This class checks the request metrics of INSTRUMENTATION=true on the read only endpoints"""
+
+    def setUp(self):
+        """Define an instrumented app with a slow route to profile."""
+        self.app = create_app(dict(TEST_CONFIG, INSTRUMENTATION=True,
+                                   PROFILE_SLOW_REQUESTS_MS=100, PROFILE_INTERVAL_MS=2))
+        self.client = self.app.test_client
+
+        @self.app.route("/slow")
+        def slow_view():
+            time.sleep(0.2)
+            return jsonify({"success": True})
+
+    # Server-Timing header
+    def test_server_timing_header(self):
+        res = self.client().get("/questions?page=1")
+        timing = re.match(r'db;dur=[\d.]+;desc="(\d+) queries", json;dur=[\d.]+, total;dur=[\d.]+$',
+                          res.headers["Server-Timing"])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(timing)
+        self.assertGreater(int(timing.group(1)), 0)
+
+    # GET '/metrics'
+    def test_get_metrics(self):
+        self.client().get("/questions?page=1")
+        self.client().get("/questions?page=1000")
+        res = self.client().get("/metrics")
+        text = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/plain")
+        self.assertIn("# TYPE trivia_request_duration_seconds histogram", text)
+        self.assertIn('trivia_responses_total{method="GET",route="/questions",status="200"} 1', text)
+        self.assertIn('trivia_responses_total{method="GET",route="/questions",status="422"} 1', text)
+        self.assertIn('trivia_request_duration_seconds_count{method="GET",route="/questions"} 2', text)
+        self.assertRegex(text, r'trivia_sql_queries_total\{method="GET",route="/questions"\} [1-9]')
+
+    # GET '/metrics/slow'
+    def test_get_slow_requests(self):
+        self.client().get("/categories")
+        self.client().get("/slow")
+        res = self.client().get("/metrics/slow")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([request["path"] for request in data["requests"]], ["/slow?"])
+        self.assertGreaterEqual(data["requests"][0]["duration"], 0.2)
+        self.assertTrue(any("slow_view" in stack for stack, count in data["requests"][0]["stacks"]))
+    # Fail
+    def test_instrumentation_off_by_default(self):
+        client = create_app(TEST_CONFIG).test_client()
+        res = client.get("/categories")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("Server-Timing", res.headers)
+        self.assertEqual(client.get("/metrics").status_code, 404)
+        self.assertEqual(client.get("/metrics/slow").status_code, 404)
+
+
+class SchemaMigrationTestCase(unittest.TestCase):
+    """This class checks the schema migration on a database with the old string category column"""
+
+    def setUp(self):
+        """Create an in-memory SQLite database with the old schema."""
+        self.engine = create_engine('sqlite://')
+        self.engine.execute('CREATE TABLE categories (id INTEGER PRIMARY KEY, type TEXT)')
+        self.engine.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, '
+                            'answer VARCHAR, category VARCHAR, difficulty INTEGER)')
+        self.engine.execute("INSERT INTO categories VALUES (1, 'Science'), (2, 'Art')")
+        self.engine.execute("INSERT INTO questions VALUES (1, 'Who discovered penicillin?', "
+                            "'Alexander Fleming', '1', 3), (2, 'La Giaconda?', 'Mona Lisa', '2', 3), "
+                            "(3, 'Lost', 'Lost', '30', 1)")
+
+    def tearDown(self):
+        """Executed after reach test"""
+        self.engine.dispose()
+
+    def test_upgrade_uses_category_indexes(self):
+        for query in HOT_QUERIES.values():
+            self.assertNotIn('ix_questions_category', query_plan(self.engine, query))
+
+        upgrade(self.engine)
+
+        self.assertIn('ix_questions_category_id', query_plan(self.engine, HOT_QUERIES['category page']))
+        self.assertIn('ix_questions_category_id', query_plan(self.engine, HOT_QUERIES['category seek']))
+        self.assertIn('ix_questions_category_difficulty',
+                      query_plan(self.engine, HOT_QUERIES['category and difficulty']))
+
+    def test_upgrade_converts_categories_in_place(self):
+        upgrade(self.engine)
+        upgrade(self.engine)
+
+        rows = self.engine.execute('SELECT id, category, typeof(category) FROM questions ORDER BY id').fetchall()
+        self.assertEqual([tuple(row) for row in rows],
+                         [(1, 1, 'integer'), (2, 2, 'integer'), (3, None, 'null')])
+
+
+class PoolTestCase(unittest.TestCase):
+    """This class checks the pool settings, their statistics and DB_CREATE_ALL on a SQLite file"""
+
+    def setUp(self):
+        """Create an empty directory for the database file."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = 'sqlite:///' + os.path.join(self.directory.name, 'trivia.db')
+        self.engines = []
+
+    def tearDown(self):
+        """Executed after reach test"""
+        for engine in self.engines:
+            engine.dispose()
+        self.directory.cleanup()
+
+    def create_app(self, **config):
+        app = create_app(dict({'SQLALCHEMY_DATABASE_URI': self.url}, **config))
+        with app.app_context():
+            self.engines.append(db.get_engine(app))
+        return app
+
+    def test_engine_options_from_environment(self):
+        environment = {'DB_POOL_SIZE': '3', 'DB_MAX_OVERFLOW': '0', 'DB_POOL_TIMEOUT': '2',
+                       'DB_POOL_RECYCLE': '60', 'DB_POOL_PRE_PING': 'false', 'DB_STATEMENT_TIMEOUT': '1000'}
+        with mock.patch.dict(os.environ, environment):
+            options = engine_options('postgresql://trivia@localhost/trivia')
+
+        self.assertEqual(options['poolclass'], TimedQueuePool)
+        self.assertEqual((options['pool_size'], options['max_overflow'], options['pool_timeout'],
+                          options['pool_recycle'], options['pool_pre_ping']), (3, 0, 2, 60, False))
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=1000'})
+        self.assertEqual(engine_options('sqlite://'), {})
+
+    def test_pool_wait_times(self):
+        engine = create_engine(self.url, poolclass=TimedQueuePool, pool_size=1, max_overflow=0)
+        self.engines.append(engine)
+        held = engine.connect()
+        waiter = threading.Thread(target=lambda: engine.connect().close())
+        waiter.start()
+        time.sleep(0.1)
+        held.close()
+        waiter.join()
+
+        threads = [threading.Thread(target=lambda: [engine.connect().close() for _ in range(50)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = pool_stats(engine)
+        self.assertEqual(stats['checkouts'], 202)
+        self.assertGreaterEqual(stats['max_wait_time'], 0.1)
+        self.assertGreaterEqual(stats['wait_time'], stats['max_wait_time'])
+
+    # GET '/debug/pool'
+    def test_get_pool_stats(self):
+        app = self.create_app(EXPOSE_POOL_STATS=True, DB_ENGINE_OPTIONS={'poolclass': TimedQueuePool, 'pool_size': 2})
+        app.test_client().get("/categories")
+        res = app.test_client().get("/debug/pool")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['pool']['pool'], 'TimedQueuePool')
+        self.assertEqual(data['pool']['size'], 2)
+        self.assertGreaterEqual(data['pool']['checkouts'], 1)
+    # Fail
+    def test_404_pool_stats_not_exposed(self):
+        res = self.create_app().test_client().get("/debug/pool")
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_create_all_disabled(self):
+        app = self.create_app(DB_CREATE_ALL=False)
+        with app.app_context():
+            tables = inspect(db.get_engine(app)).get_table_names()
+            self.assertFalse(set(db.metadata.tables).intersection(tables))
+
+        app = self.create_app()
+        with app.app_context():
+            self.assertIn('questions', inspect(db.get_engine(app)).get_table_names())
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """This class checks the routing of reads to a replica, on two SQLite files"""
+
+    def setUp(self):
+        """Create a primary and a replica whose copy of question 5 differs."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.primary_url = 'sqlite:///' + os.path.join(self.directory.name, 'primary.db')
+        self.replica_url = 'sqlite:///' + os.path.join(self.directory.name, 'replica.db')
+        for url in (self.primary_url, self.replica_url):
+            engine = create_engine(url)
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                load_trivia_data(connection)
+            engine.dispose()
+        create_engine(self.replica_url).execute("UPDATE questions SET answer = 'replica' WHERE id = 5")
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+        self.app.extensions['replicas'].dispose()
+        self.directory.cleanup()
+
+    def create_app(self, replicas):
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.primary_url, 'DB_REPLICA_URLS': replicas})
+        return self.app.test_client()
+
+    def answer_of_question_5(self, client):
+        data = json.loads(client.get("/questions?page=1").data)
+        return [question['answer'] for question in data['questions'] if question['id'] == 5][0]
+
+    def test_reads_from_replica_until_client_writes(self):
+        client = self.create_app(self.replica_url)
+
+        self.assertEqual(self.answer_of_question_5(client), 'replica')
+
+        res = client.post("/questions", json={"question": "Quel est ton nom ?", "answer": "Gregory",
+                                              "category": 3, "difficulty": 5})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('read_primary=1', res.headers['Set-Cookie'])
+        self.assertEqual(self.answer_of_question_5(client), 'Maya Angelou')
+        self.assertEqual(self.answer_of_question_5(self.app.test_client()), 'replica')
+
+    def test_batch_writes_read_from_primary(self):
+        client = self.create_app(self.replica_url)
+        res = client.post("/questions/batch", json={"questions": [
+            {"question": "Quel est ton nom ?", "answer": "Gregory", "category": 3, "difficulty": 5}]})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('read_primary=1', res.headers['Set-Cookie'])
+        self.assertEqual(self.answer_of_question_5(client), 'Maya Angelou')
+
+        client = self.app.test_client()
+        res = client.delete("/questions/batch", json={"ids": [9]})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('read_primary=1', res.headers['Set-Cookie'])
+
+        client = self.app.test_client()
+        res = client.post("/questions/import", data='{"question": "Q", "answer": "A", "category": 1, "difficulty": 1}',
+                          content_type="application/x-ndjson")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('read_primary=1', res.headers['Set-Cookie'])
+    # Fail
+    def test_unavailable_replica_falls_back_to_primary(self):
+        client = self.create_app(['sqlite:///' + os.path.join(self.directory.name, 'missing', 'replica.db')])
+
+        self.assertEqual(self.answer_of_question_5(client), 'Maya Angelou')
+        self.assertEqual(self.app.extensions['replicas'].fallbacks, 1)
+
+
+@unittest.skipIf(aiosqlite is None, 'the async mode needs aiosqlite')
+class AsgiTestCase(unittest.TestCase):
+    """This class checks the ASGI app on a temporary SQLite file, which its async driver can open"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create the database file and load the trivia data."""
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.app = create_asgi_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(cls.directory.name, 'trivia.db')
+        })
+        with cls.app.flask_app.app_context():
+            with db.get_engine(cls.app.flask_app).begin() as connection:
+                load_trivia_data(connection)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Executed after the last test"""
+        with cls.app.flask_app.app_context():
+            db.get_engine(cls.app.flask_app).dispose()
+        cls.directory.cleanup()
+
+    def request(self, method, path, query=b'', body=None, headers=()):
+        """Send one request through the ASGI interface and return its status and JSON, keeping its headers."""
+        messages = [{'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b''}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+                 'headers': [(b'content-type', b'application/json')] +
+                            [(name.lower().encode(), value.encode()) for name, value in headers]}
+
+        async def run():
+            # the driver's connections belong to this event loop
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                await self.app.db.close()
+
+        asyncio.run(run())
+        self.headers = [(name.decode().lower(), value.decode()) for name, value in sent[0]['headers']]
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        if ('content-encoding', 'gzip') in self.headers:
+            body = gzip.decompress(body)
+        return sent[0]['status'], json.loads(body) if body else None
+
+    # GET '/questions' on the event loop
+    def test_asgi_get_questions(self):
+        status, data = self.request('GET', '/questions', b'page=2')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['questions']), 9)
+        self.assertEqual(data['total_questions'], 19)
+        self.assertTrue(data['categories'])
+
+    def test_asgi_304_sends_matched_etag(self):
+        status, data = self.request('GET', '/questions', b'page=1', headers=[('Accept-Encoding', 'gzip')])
+        etag = dict(self.headers)['etag']
+
+        self.assertEqual(status, 200)
+        self.assertTrue(etag.endswith('-gzip"'))
+
+        status, data = self.request('GET', '/questions', b'page=1', headers=[
+            ('Accept-Encoding', 'gzip'), ('If-None-Match', '{}, {}'.format(etag.replace('-gzip', ''), etag))])
+
+        self.assertEqual(status, 304)
+        self.assertEqual(dict(self.headers)['etag'], etag)
+        self.assertIn(('vary', 'Accept-Encoding'), self.headers)
+    # Fail
+    def test_422_asgi_questions_beyond_last_page(self):
+        status, data = self.request('GET', '/questions', b'page=1000')
+
+        self.assertEqual(status, 422)
+        self.assertEqual(data["success"], False)
+
+    # POST '/quizzes' on the event loop, session mode through flaskr
+    def test_asgi_quizzes(self):
+        status, data = self.request('POST', '/quizzes', body={'previous_questions': [20], 'count': 5,
+                                                               'quiz_category': {'type': "Science", 'id': "1"}})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(question['id'] for question in data['questions']), [21, 22])
+
+        status, data = self.request('POST', '/quizzes', body={'session': True,
+                                                               'quiz_category': {'type': "Science", 'id': "1"}})
+
+        self.assertEqual(status, 200)
+        self.assertTrue(data['session_id'])
+
+    # POST '/quizzes' on the event loop, excluding previous questions
+    def test_asgi_quiz_excludes_previous_questions(self):
+        drawn = set()
+        for count in (None, 1) * 20:
+            body = {'previous_questions': [20], 'quiz_category': {'type': "Science", 'id': "1"}}
+            if count is not None:
+                body['count'] = count
+            status, data = self.request('POST', '/quizzes', body=body)
+            self.assertEqual(status, 200)
+            drawn.add(data['question']['id'])
+
+        self.assertEqual(drawn, {21, 22})
+
+        status, data = self.request('POST', '/quizzes', body={'previous_questions': [20, 21, 22],
+                                                               'quiz_category': {'type': "Science", 'id': "1"}})
+        self.assertEqual(status, 200)
+        self.assertIsNone(data['question'])
+
+    # POST '/quizzes' difficulty modes through flaskr
+    def test_asgi_quiz_questions_by_difficulty(self):
+        status, data = self.request('POST', '/quizzes', body={'previous_questions': [], 'count': 3, 'difficulty': 4,
+                                                               'quiz_category': {'type': "click", 'id': 0}})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['questions']), 3)
+        self.assertEqual(set(question['difficulty'] for question in data['questions']), {4})
+
+        status, data = self.request('POST', '/quizzes', body={'previous_questions': [], 'difficulty': 'bogus',
+                                                               'quiz_category': {'type': "click", 'id': 0}})
+
+        self.assertEqual(status, 422)
+        self.assertEqual(data["success"], False)
+    # Fail
+    def test_404_asgi_unknown_category(self):
+        status, data = self.request('GET', '/categories/1000/questions')
+
+        self.assertEqual(status, 404)
+        self.assertEqual(data["success"], False)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -17,9 +17,30 @@ class QuestionView extends Component {
   }
 
   componentDidMount() {
-    this.getQuestions();
+    this.getBootstrap();
   }
 
+  // categories and the first page of questions in one round trip
+  getBootstrap = () => {
+    $.ajax({
+      url: `/bootstrap`,
+      type: 'GET',
+      success: (result) => {
+        this.setState({
+          questions: result.questions,
+          totalQuestions: result.total_questions,
+          categories: result.categories,
+          currentCategory: result.current_category,
+        });
+        return;
+      },
+      error: (error) => {
+        alert('Unable to load questions. Please try your request again');
+        return;
+      },
+    });
+  };
+
   getQuestions = () => {
     $.ajax({
       url: `/questions?page=${this.state.page}`, //TODO: update request URL
@@ -85,15 +106,8 @@ class QuestionView extends Component {
 
   submitSearch = (searchTerm) => {
     $.ajax({
-      url: `/questions`, //TODO: update request URL
-      type: 'POST',
-      dataType: 'json',
-      contentType: 'application/json',
-      data: JSON.stringify({ searchTerm: searchTerm }),
-      xhrFields: {
-        withCredentials: true,
-      },
-      crossDomain: true,
+      url: `/questions/search?q=${encodeURIComponent(searchTerm)}`,
+      type: 'GET',
       success: (result) => {
         this.setState({
           questions: result.questions,
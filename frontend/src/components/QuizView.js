@@ -14,6 +14,7 @@ class QuizView extends Component {
       categories: {},
       numCorrect: 0,
       currentQuestion: {},
+      prefetchedQuestions: [],
       guess: '',
       forceEnd: false,
     };
@@ -48,6 +49,20 @@ class QuizView extends Component {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    // play the questions fetched with the previous one before asking again
+    if (this.state.prefetchedQuestions.length) {
+      const [nextQuestion, ...prefetchedQuestions] = this.state.prefetchedQuestions;
+      this.setState({
+        showAnswer: false,
+        previousQuestions: previousQuestions,
+        currentQuestion: nextQuestion,
+        prefetchedQuestions: prefetchedQuestions,
+        guess: '',
+        forceEnd: false,
+      });
+      return;
+    }
+
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: 'POST',
@@ -56,6 +71,7 @@ class QuizView extends Component {
       data: JSON.stringify({
         previous_questions: previousQuestions,
         quiz_category: this.state.quizCategory,
+        count: Math.max(questionsPerPlay - previousQuestions.length, 1),
       }),
       xhrFields: {
         withCredentials: true,
@@ -66,6 +82,7 @@ class QuizView extends Component {
           showAnswer: false,
           previousQuestions: previousQuestions,
           currentQuestion: result.question,
+          prefetchedQuestions: result.questions.slice(1),
           guess: '',
           forceEnd: result.question ? false : true,
         });
@@ -94,6 +111,7 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      prefetchedQuestions: [],
       guess: '',
       forceEnd: false,
     });
@@ -1,8 +1,10 @@
 import React, { Component } from 'react';
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   };
 
   getInfo = (event) => {
@@ -13,6 +15,24 @@ class Search extends Component {
   handleInputChange = () => {
     this.setState({
       query: this.search.value,
+    }, () => this.getSuggestions());
+  };
+
+  // suggestions while typing, answered from the server's in-memory index
+  getSuggestions = () => {
+    if (this.pending) {
+      this.pending.abort();
+    }
+    if (!this.state.query.trim()) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+    this.pending = $.ajax({
+      url: `/questions/autocomplete?q=${encodeURIComponent(this.state.query)}`,
+      type: 'GET',
+      success: (result) => {
+        this.setState({ suggestions: result.suggestions });
+      },
     });
   };
 
@@ -23,7 +43,13 @@ class Search extends Component {
           placeholder='Search questions...'
           ref={(input) => (this.search = input)}
           onChange={this.handleInputChange}
+          list='question-suggestions'
         />
+        <datalist id='question-suggestions'>
+          {this.state.suggestions.map((suggestion) => (
+            <option key={suggestion.id} value={suggestion.question} />
+          ))}
+        </datalist>
         <input type='submit' value='Submit' className='button' />
       </form>
     );